@@ -0,0 +1,118 @@
+'''
+Pool of persistent ADDE connections
+Keeps up to size open AddeClient sessions per host and hands them out to
+successive aget calls instead of opening a new session for every request
+'''
+
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger("client")
+
+
+class AddePool:
+    '''
+    Pool of open AddeClient sessions keyed by host
+
+    client_factory(host=, project=, user=) must return an async context
+    manager with an aget method, pyadde's AddeClient by default. Swap it for
+    a stand-in client to test without the network, as test_addepool.py does.
+    An astream method, an async iterator of the AREA bytes, is used by
+    fetchfile.fetch_stream.
+    check is an optional coroutine function(client) -> bool run on an idle
+    session before reuse, sessions idle longer than max_idle seconds or that
+    raised during a request are closed instead of reused.
+    '''
+
+    def __init__(self, project=0, user='XXXX', size=4, max_idle=60.0, check=None, client_factory=None):
+        if client_factory is None:
+            from pyadde.client import AddeClient
+            client_factory = AddeClient
+        self.project = project
+        self.user = user
+        self.size = size
+        self.max_idle = max_idle
+        self.check = check
+        self.client_factory = client_factory
+        self.closed = False
+        self._idle = {}
+        self._slots = {}
+        self.stats = {'opened': 0, 'reused': 0, 'discarded': 0}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _slot(self, host):
+        if host not in self._slots:
+            self._slots[host] = asyncio.Semaphore(self.size)
+        return self._slots[host]
+
+    async def _healthy(self, client, last_used):
+        if time.monotonic() - last_used > self.max_idle:
+            return False
+        if self.check is not None:
+            try:
+                return await self.check(client)
+            except Exception:
+                return False
+        return True
+
+    async def _discard(self, client):
+        self.stats['discarded'] += 1
+        try:
+            await client.__aexit__(None, None, None)
+        except Exception as e:
+            logger.debug(f'Error closing ADDE session: {e}')
+
+    async def acquire(self, host):
+        '''Check out an open session for host, opening one if none is idle'''
+        if self.closed:
+            raise RuntimeError('AddePool is closed')
+        await self._slot(host).acquire()
+        idle = self._idle.setdefault(host, [])
+        while idle:
+            client, last_used = idle.pop()
+            if await self._healthy(client, last_used):
+                self.stats['reused'] += 1
+                return client
+            await self._discard(client)
+
+        try:
+            client = self.client_factory(host=host, project=self.project, user=self.user)
+            client = await client.__aenter__() or client
+        except BaseException:
+            self._slot(host).release()
+            raise
+        self.stats['opened'] += 1
+        return client
+
+    async def release(self, host, client, healthy=True):
+        '''Return a session to the pool, or close it if it is not healthy'''
+        if healthy and not self.closed:
+            self._idle.setdefault(host, []).append((client, time.monotonic()))
+        else:
+            await self._discard(client)
+        self._slot(host).release()
+
+    async def aget(self, host, **kwargs):
+        '''AddeClient.aget on a pooled session'''
+        client = await self.acquire(host)
+        try:
+            area_file = await client.aget(**kwargs)
+        except BaseException:
+            await self.release(host, client, healthy=False)
+            raise
+        await self.release(host, client)
+        return area_file
+
+    async def close(self):
+        '''Close every idle session, sessions still checked out are closed on release'''
+        self.closed = True
+        for idle in self._idle.values():
+            while idle:
+                client, _ = idle.pop()
+                await self._discard(client)
@@ -0,0 +1,142 @@
+'''
+Streaming McIDAS AREA transfers
+AreaStream parses an AREA file from its bytes as they arrive: the directory
+and nav block from the head of the stream, then the image data a block of
+lines at a time. Every chunk can be written straight to a file and each
+completed block of lines handed to a callback, so the memory held per
+transfer is the head plus one block of lines, however large the image is.
+
+The directory, nav and data layout are those of mmaparea.
+'''
+
+import numpy as np
+from mmaparea import DIRECTORY_WORDS, COMMENT_SIZE, read_directory, nav_block, data_view, comment_cards
+
+HEADER_SIZE = DIRECTORY_WORDS * 4
+
+
+class AreaStream:
+    '''
+    Incremental AREA parser, feed it the bytes of one AREA file in order
+
+    file is an open binary file every chunk is written to as it is fed.
+    on_lines(stream, start, block) is called with every block_lines lines,
+    block is a (bands, lines, elements) array only valid during the call,
+    start the first line of the block. directory and nav are None until the
+    head of the stream up to the data block has arrived.
+    '''
+
+    def __init__(self, file=None, on_lines=None, block_lines=64):
+        self.file = file
+        self.on_lines = on_lines
+        self.block_lines = block_lines
+        self.directory = None
+        self.byteorder = None
+        self.nav = None
+        self.received = 0
+        self.lines_received = 0
+        self._head = bytearray()
+        self._block = None
+        self._block_fill = 0
+        self._data_left = 0
+        self._tail = bytearray()
+
+    @property
+    def complete(self):
+        '''True once every line of the image has arrived'''
+        return self.directory is not None and self.lines_received == self.directory.lines
+
+    def feed(self, chunk):
+        '''Parse the next chunk of bytes'''
+        if self.file is not None:
+            self.file.write(chunk)
+        self.received += len(chunk)
+        view = memoryview(chunk).cast('B')
+        while view:
+            if self.nav is None:
+                view = self._feed_head(view)
+            elif self._data_left:
+                view = self._feed_data(view)
+            else:
+                # comment cards follow the data, anything past them is ignored
+                take = max(self.directory.comment_count * COMMENT_SIZE - len(self._tail), 0)
+                self._tail += view[:take]
+                break
+
+    def _feed_head(self, view):
+        '''Buffer the directory, nav and cal blocks, parsing them once the data block starts'''
+        need = (self.directory.data_block_offset if self.directory else HEADER_SIZE) - len(self._head)
+        self._head += view[:need]
+        view = view[need:]
+        head = np.frombuffer(self._head, dtype=np.uint8)
+        if self.directory is None and len(self._head) == HEADER_SIZE:
+            adir, self.byteorder = read_directory(head)
+            if adir.data_block_offset < HEADER_SIZE or 0 < adir.data_block_offset < adir.nav_block_offset:
+                raise ValueError('AREA streams need the nav block ahead of the data block')
+            self.directory = adir
+        if self.directory is not None and len(self._head) == self.directory.data_block_offset:
+            adir = self.directory
+            self.nav = nav_block(head.copy(), adir, self.byteorder)
+            self._data_left = adir.lines * adir.line_bytes
+            if self.on_lines is not None:
+                self._block = bytearray(min(self.block_lines, max(adir.lines, 1)) * adir.line_bytes)
+            if not self._data_left:
+                self._emit()
+        return view
+
+    def _feed_data(self, view):
+        '''Count data lines, collecting them into blocks when there is a callback'''
+        adir = self.directory
+        take = min(len(view), self._data_left)
+        self._data_left -= take
+        if self._block is None:
+            self.lines_received = adir.lines - -(-self._data_left // adir.line_bytes)
+            return view[take:]
+
+        data = view[:take]
+        while data:
+            n = min(len(data), len(self._block) - self._block_fill)
+            self._block[self._block_fill:self._block_fill + n] = data[:n]
+            self._block_fill += n
+            data = data[n:]
+            if self._block_fill == len(self._block) or not self._data_left and not data:
+                self._emit()
+        return view[take:]
+
+    def _emit(self):
+        '''Hand the buffered lines to on_lines'''
+        adir = self.directory
+        lines = self._block_fill // adir.line_bytes if adir.line_bytes else 0
+        start = self.lines_received
+        self.lines_received += lines
+        self._block_fill = 0
+        if lines and self.on_lines is not None:
+            self.on_lines(self, start, data_view(self._block, adir, self.byteorder, lines=lines, offset=0))
+
+    def finish(self):
+        '''Check the whole image arrived, returns the comment cards'''
+        if not self.complete:
+            expected = self.directory.data_block_offset + self.directory.lines * self.directory.line_bytes \
+                if self.directory else HEADER_SIZE
+            raise ValueError(f'AREA stream ended at byte {self.received} of {expected}')
+        self.directory.comment_cards = comment_cards(np.frombuffer(self._tail, dtype=np.uint8))
+        return self.directory.comment_cards
+
+
+async def feed_stream(chunks, file=None, on_lines=None, block_lines=64):
+    '''Parse the async iterator of byte chunks into an AreaStream, returns the finished stream'''
+    stream = AreaStream(file=file, on_lines=on_lines, block_lines=block_lines)
+    async for chunk in chunks:
+        stream.feed(chunk)
+    stream.finish()
+    return stream
+
+
+def replay(filename, on_lines, block_lines=64, chunk_size=2**20):
+    '''Hand the lines of a local AREA file to on_lines a block at a time, reading chunk_size bytes at a time'''
+    stream = AreaStream(on_lines=on_lines, block_lines=block_lines)
+    with open(filename, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            stream.feed(chunk)
+    stream.finish()
+    return stream
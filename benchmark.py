@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+'''
+Benchmarks for the fetch -> navigate -> resample -> write pipeline
+Runs on synthetic AREA files with a synthetic GOES nav block, no network needed
+Prints one JSON line per stage and image size
+'''
+
+import os
+import sys
+import json
+import time
+import struct
+import datetime
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+from pyarea.file import AreaFile
+
+doc = '''
+usage: ./benchmark.py [sizes=<sizes>] [repeat=<repeat>] [reference=<reference>] [step=<step>] [output=<output>]
+
+Benchmark navigation, nn_radius, projections and netCDF writing on synthetic AREA files
+
+arguments:
+  sizes              comma separated image sizes (lines and elements), default=256,512,1024
+  repeat             runs per stage, the fastest is reported, default=3
+  reference          largest size the per-pixel nvxgoes reference nav_transform2 is run at, default=256
+  step               tie point spacing of the interpolated nav_transform, default=16
+  output             file name JSON lines results are appended to, default=stdout
+'''
+
+NAV_WORDS = 640
+COMMENTS = ['synthetic AREA file for benchmark.py'.ljust(80)]
+
+
+def synthetic_nav(yyddd=78068, hhmmss=173000):
+    '''GOES nav block for a satellite near 91.7E with a 1821 line IR frame'''
+    nav = [0] * NAV_WORDS
+    nav[0] = int.from_bytes(b'GOES', 'big')
+    nav[1] = yyddd
+    nav[2] = hhmmss
+    nav[4] = 780301         # epoch date YYMMDD
+    nav[5] = 0              # epoch time
+    nav[6] = 4216420        # semi-major axis, km * 100
+    nav[7] = 200            # eccentricity * 1000000
+    nav[8] = 500            # inclination, degrees * 1000
+    nav[9] = 0              # mean anomaly
+    nav[10] = 0             # argument of perigee
+    nav[11] = 250000        # right ascension of ascending node, degrees * 1000
+    nav[12] = 895900        # declination of the spin axis, DDDMMSS
+    nav[13] = 0             # right ascension of the spin axis, DDDMMSS
+    nav[14] = 911           # picture center line
+    nav[15] = 100000        # spin rate, rpm * 1000
+    nav[16] = 200000        # line direction sweep angle, DDDMMSS
+    nav[17] = 1821          # scan lines
+    nav[18] = 200000        # element direction sweep angle, DDDMMSS
+    nav[19] = 1821          # elements per line
+    return nav
+
+
+def synthetic_area_bytes(lines, elements, bands=1, yyddd=78068, hhmmss=173000):
+    '''McIDAS AREA file covering the synthetic disk at lines x elements, 1 byte per element'''
+    res = max(1, 1821 // max(lines, elements))
+    nav_offset = 256
+    data_offset = nav_offset + NAV_WORDS * 4
+
+    directory = [0] * 64
+    directory[1] = 4                        # image_type
+    directory[2] = 32                       # sensor_source_number
+    directory[3] = yyddd
+    directory[4] = hhmmss
+    directory[5] = 1 + (1821 - lines * res) // 2    # line_ul
+    directory[6] = 1 + (1821 - elements * res) // 2  # element_ul
+    directory[8] = lines
+    directory[9] = elements
+    directory[10] = 1                       # bytes_per_element
+    directory[11] = res
+    directory[12] = res
+    directory[13] = bands
+    directory[16] = yyddd
+    directory[17] = hhmmss
+    directory[18] = sum(1 << b for b in range(bands))   # band map, bands 1..n
+    directory[33] = data_offset
+    directory[34] = nav_offset
+    directory[45] = yyddd
+    directory[46] = hhmmss
+    directory[63] = len(COMMENTS)
+
+    header = bytearray(struct.pack('>64i', *directory))
+    header[24 * 4:32 * 4] = b'synthetic benchmark AREA file'.ljust(32)
+    header[51 * 4:52 * 4] = b'VISR'
+    header[52 * 4:53 * 4] = b'BRIT'
+    header[56 * 4:57 * 4] = b'VISR'
+    header[57 * 4:58 * 4] = b'BRIT'
+
+    rng = np.random.default_rng(0)
+    data = rng.integers(0, 256, size=(lines, elements, bands), dtype=np.uint8)  # bands interleaved by pixel
+    return (bytes(header) + struct.pack(f'>{NAV_WORDS}i', *synthetic_nav(yyddd, hhmmss)) + data.tobytes()
+            + ''.join(COMMENTS).encode())
+
+
+def measure(func, repeat):
+    '''Fastest wall time of repeat calls plus the peak traced memory of one call'''
+    best = None
+    for _ in range(repeat):
+        then = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - then
+        best = seconds if best is None else min(best, seconds)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def record(stage, area, seconds=None, peak=None, status='ok', **extra):
+    adir = area.directory
+    pixels = adir.lines * adir.elements
+    return dict({
+        'stage': stage, 'lines': adir.lines, 'elements': adir.elements, 'bands': adir.spectral_band_count,
+        'pixels': pixels, 'seconds': seconds, 'pixels_per_second': pixels / seconds if seconds else None,
+        'peak_bytes': peak, 'status': status,
+    }, **extra)
+
+
+def run(sizes=(256, 512, 1024), repeat=3, reference=256, step=16):
+    '''Benchmark every stage at every size, yields one result dict per stage and size'''
+    from write_netcdf import nav_transform, nav_transform2, write
+    from goesnav import tiepoint_error
+    from spacing import nn_radius
+
+    for size in sizes:
+        area = AreaFile(synthetic_area_bytes(size, size))
+
+        (lat, lon, proj_lat, proj_lon), exact_seconds, peak = measure(lambda: nav_transform(area), repeat)
+        yield record('nav_transform', area, exact_seconds, peak)
+
+        # every size is the full disk, so this also checks how much of the limb is navigated exactly
+        _, seconds, peak = measure(lambda: nav_transform(area, step=step), repeat)
+        max_lat, max_lon, mismatch, exact_fraction = tiepoint_error(area, step)
+        yield record('nav_transform.tiepoints', area, seconds, peak, step=step,
+                     max_lat_error=max_lat, max_lon_error=max_lon, limb_mismatch=mismatch,
+                     exact_fraction=exact_fraction, speedup=exact_seconds / seconds if seconds else None)
+
+        if size <= reference:
+            try:
+                _, seconds, peak = measure(lambda: nav_transform2(area), 1)
+                yield record('nav_transform2', area, seconds, peak)
+            except ImportError as e:
+                yield record('nav_transform2', area, status=f'skipped: {e}')
+
+        radius, seconds, peak = measure(lambda: nn_radius(lat, lon), repeat)
+        yield record('nn_radius', area, seconds, peak)
+
+        try:
+            from pyresample import geometry
+            import projections
+            swath_def = geometry.SwathDefinition(lons=lon, lats=lat)
+            for name in ('geostationary', 'plate_carree', 'robinson', 'mollweide'):
+                project = getattr(projections, name)
+                _, seconds, peak = measure(lambda: project(swath_def, area.data[0], proj_lat, proj_lon, radius), repeat)
+                yield record(f'projections.{name}', area, seconds, peak)
+        except ImportError as e:
+            yield record('projections', area, status=f'skipped: {e}')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'bench.nc')
+            _, seconds, peak = measure(lambda: write(area, lat, lon, filename=filename), repeat)
+            yield record('write', area, seconds, peak)
+
+
+if __name__ == '__main__':
+    if any(a in ('-h', '--help') for a in sys.argv[1:]):
+        print(doc)
+        sys.exit(0)
+    clargs = dict((s.split('=', 1) + [None])[:2] for s in sys.argv[1:])
+    sizes = [int(s) for s in clargs.get('sizes', '256,512,1024').split(',')]
+    repeat = int(clargs.get('repeat', 3))
+    reference = int(clargs.get('reference', 256))
+    step = int(clargs.get('step', 16))
+
+    run_info = {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+    }
+    out = open(clargs['output'], 'a') if clargs.get('output') else sys.stdout
+    try:
+        for result in run(sizes, repeat, reference, step):
+            out.write(json.dumps(dict(run_info, **result)) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+'''
+Bulk conversion of local AREA files to netCDF
+Every AREA file matching the input directory or glob is memory-mapped,
+navigated with nav_transform and written with write_netcdf.write, one file
+per worker process. Outputs newer than their AREA file are skipped.
+'''
+
+import os
+import sys
+import glob
+import json
+import logging
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from mmaparea import open_area, is_area
+from filecache import FileCache
+from write_netcdf import nav_transform, write
+
+logger = logging.getLogger("client")
+
+doc = '''
+usage: ./convert.py input=<input> [outdir=<outdir>] [workers=<workers>] [force=<force>] [navcache=<navcache>]
+                    [navstep=<navstep>] [zlib=<zlib>] [pack=<pack>] [summary=<summary>]
+
+Convert a directory or glob of AREA files to netCDF
+
+arguments:
+  input              directory of AREA files, or a glob such as 'archive/*/AREA*' (quoted), files without an AREA
+                     directory, hidden, .nc and .json files are skipped
+  outdir             directory netCDF files are written to, <AREA file name>.nc, default=next to each AREA file
+  workers            number of conversion processes, default=number of cpus
+  force              YES to convert files whose netCDF output is already up to date, default=NO
+  navcache           directory to cache navigation results in, shared by images with the same nav, default=None
+  navstep            navigate every navstep'th line and element and interpolate the rest, default=None
+  zlib               YES to compress the netCDF variables, default=NO
+  pack               YES to store lat/lon as scaled 16 bit integers, default=NO
+  summary            file name the JSON summary of every file is saved to, default=None
+'''
+
+
+def area_files(pattern, exclude=()):
+    '''
+    AREA files in directory pattern, or matching the glob pattern, sorted
+
+    Hidden files, such as the temporary files convert writes, netCDF and JSON
+    files, the paths in exclude and files without an AREA directory are left out.
+    '''
+    names = (os.path.join(pattern, n) for n in os.listdir(pattern)) if os.path.isdir(pattern) else glob.glob(pattern)
+    exclude = {os.path.abspath(p) for p in exclude if p}
+    paths = []
+    for p in names:
+        if os.path.basename(p).startswith('.') or p.endswith(('.nc', '.json')) or os.path.abspath(p) in exclude:
+            continue
+        if os.path.isfile(p) and is_area(p):
+            paths.append(p)
+        elif os.path.isfile(p):
+            logger.info(f'Skipping {p}, not an AREA file')
+    return sorted(paths)
+
+
+def output_name(area_path, outdir=None):
+    '''netCDF file name for an AREA file'''
+    return os.path.join(outdir or os.path.dirname(area_path), os.path.basename(area_path) + '.nc')
+
+
+def up_to_date(area_path, nc_path):
+    '''True if nc_path exists and is newer than area_path'''
+    try:
+        return os.path.getmtime(nc_path) >= os.path.getmtime(area_path)
+    except OSError:
+        return False
+
+
+def convert(area_path, nc_path, nav_cache=None, nav_step=None, zlib=False, pack=False):
+    '''Convert one AREA file, the netCDF file only appears once it is complete'''
+    then = datetime.datetime.now()
+    area = open_area(area_path)
+    cache = FileCache(nav_cache) if nav_cache else None
+    lat, lon, _, _ = nav_transform(area, cache=cache, step=nav_step)
+
+    tmp = os.path.join(os.path.dirname(nc_path) or '.', f'.{os.path.basename(nc_path)}.{os.getpid()}')
+    try:
+        write(area, lat, lon, filename=tmp, audit_str=f'./convert.py input={area_path}', zlib=zlib, pack=pack or None)
+        os.replace(tmp, nc_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return {'seconds': (datetime.datetime.now() - then).total_seconds(), 'bytes': os.path.getsize(nc_path)}
+
+
+def convert_all(paths, outdir=None, workers=None, force=False, **options):
+    '''
+    Convert every AREA file in paths across workers processes
+
+    Yields one status dict per file as it finishes, skipped files first.
+    options are passed on to convert.
+    '''
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+
+    todo = []
+    for path in paths:
+        nc_path = output_name(path, outdir)
+        if not force and up_to_date(path, nc_path):
+            yield {'area': path, 'netcdf': nc_path, 'status': 'skipped'}
+        else:
+            todo.append((path, nc_path))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convert, path, nc_path, **options): (path, nc_path) for path, nc_path in todo}
+        for future in as_completed(futures):
+            path, nc_path = futures[future]
+            status = {'area': path, 'netcdf': nc_path}
+            try:
+                status.update(future.result(), status='converted')
+            except Exception as err:
+                status.update(status='failed', error=f'{type(err).__name__}: {err}')
+            yield status
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    logger.setLevel('INFO')
+    if len(sys.argv) < 2 or any(a in ('-h', '--help') for a in sys.argv[1:]):
+        print(doc)
+        sys.exit(0 if len(sys.argv) > 1 else 1)
+    clargs = dict((s.split('=', 1) + [None])[:2] for s in sys.argv[1:])
+    if not clargs.get('input'):
+        raise KeyError('input must be specified')
+
+    paths = area_files(clargs['input'], exclude=[clargs.get('summary')])
+    workers = int(clargs['workers']) if clargs.get('workers') else None
+    options = {
+        'nav_cache': clargs.get('navcache'),
+        'nav_step': int(clargs.get('navstep') or 0) or None,
+        'zlib': (clargs.get('zlib') or 'NO').upper() == 'YES',
+        'pack': (clargs.get('pack') or 'NO').upper() == 'YES',
+    }
+    force = (clargs.get('force') or 'NO').upper() == 'YES'
+
+    then = datetime.datetime.now()
+    logger.info(f'{len(paths)} AREA files to check')
+    summary = []
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+    for status in convert_all(paths, outdir=clargs.get('outdir'), workers=workers, force=force, **options):
+        summary.append(status)
+        counts[status['status']] += 1
+        if status['status'] != 'skipped':
+            logger.info(f'[{len(summary)}/{len(paths)}] {status["status"]} {status["area"]} {status.get("error", "")}')
+
+    seconds = (datetime.datetime.now() - then).total_seconds()
+    logger.info(f'{counts["converted"]} converted, {counts["skipped"]} up to date, {counts["failed"]} failed '
+                f'in {seconds:.1f}s')
+    if clargs.get('summary'):
+        with open(clargs['summary'], 'w') as f:
+            json.dump({'counts': counts, 'seconds': seconds, 'files': summary}, f, indent=1)
+    sys.exit(1 if counts['failed'] else 0)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+'''
+Time series extraction of station points and small boxes across many images
+Only the sub-sector around the points is fetched from each image, found by
+reverse navigation of a one pixel probe request. Each image's own nav then
+places the points, and one CSV row per image, band and point is appended to
+the output as soon as the image arrives.
+'''
+
+import os
+import sys
+import csv
+import math
+import asyncio
+import logging
+import datetime
+import numpy as np
+from addepool import AddePool
+from goesnav import GoesNav, pixel_index
+from metrics import metrics, current_request
+from fetchfile import expand_requests, read_manifest, fetch_with_retries
+
+logger = logging.getLogger("client")
+
+COLUMNS = ['request_id', 'time', 'day', 'hhmmss', 'band', 'point', 'lat', 'lon', 'line', 'element',
+           'pixel_lat', 'pixel_lon', 'value', 'mean', 'min', 'max', 'count']
+
+doc = '''
+usage: ./extract.py host=<host> user=<user> project=<project> group=<group> descriptor=<descriptor> band=<band>
+                    (points=<points> | stations=<stations>) output=<output> [box=<box>] [margin=<margin>]
+                    [days=<days>] [times=<times>] [bands=<bands>] [positions=<positions>] [manifest=<manifest>]
+                    [concurrency=<concurrency>] [retries=<retries>] [connections=<connections>] [metrics=<metrics>]
+                    [any other fetchfile request argument, e.g. lmag=<lmag> emag=<emag> unit=<unit>]
+
+Extract point and box time series across many images of a navigable AGOES01 - AGOES07 group
+
+arguments:
+  points             semicolon separated points, each "lat,lon" or "name,lat,lon", east positive lon
+  stations           CSV file with name, lat and lon columns, instead of points
+  output             CSV file rows are appended to, the header is written if the file is new
+  box                half width in pixels of the box statistics are taken over, 0 for the point only, default=1
+  margin             pixels added around the points to allow for nav differences between images, default=16
+  days, times, bands, positions, manifest, concurrency, retries, connections
+                     as in ./fetchfile.py -b
+  metrics            file name per stage timings are saved to, default=None
+'''
+
+
+def read_points(points=None, stations=None):
+    '''List of (name, lat, lon) from a points argument or a stations CSV file'''
+    if stations:
+        with open(stations, newline='') as f:
+            return [(r['name'], float(r['lat']), float(r['lon'])) for r in csv.DictReader(f)]
+    result = []
+    for n, p in enumerate(p for p in (points or '').split(';') if p.strip()):
+        fields = [f.strip() for f in p.split(',')]
+        name = fields[0] if len(fields) == 3 else f'p{n}'
+        result.append((name, float(fields[-2]), float(fields[-1])))
+    return result
+
+
+def sector_request(area, points, margin=16):
+    '''
+    Image coordinate request arguments of the sub-sector covering every point,
+    from the nav and resolution of area (e.g. a one pixel probe)
+    '''
+    adir = area.directory
+    lat = np.array([p[1] for p in points])
+    lon = np.array([p[2] for p in points])
+    line, elem = GoesNav(area.nav).line_elem(lat, lon)
+    if np.isnan(line).all():
+        raise ValueError('none of the points can be seen by the satellite')
+
+    first_line = np.nanmin(line) - margin * adir.line_res
+    first_elem = np.nanmin(elem) - margin * adir.element_res
+    nlines = math.ceil((np.nanmax(line) - np.nanmin(line)) / adir.line_res) + 2 * margin + 1
+    nelems = math.ceil((np.nanmax(elem) - np.nanmin(elem)) / adir.element_res) + 2 * margin + 1
+    return {'coord_type': 'I', 'coord_pos': 'U', 'coord_start_dim1': max(int(first_line), 1),
+            'coord_start_dim2': max(int(first_elem), 1), 'nlines': nlines, 'nelems': nelems}
+
+
+def point_rows(area, points, box=1):
+    '''One row per band and point, with the centre pixel and the statistics of the box around it'''
+    adir = area.directory
+    lat = np.array([p[1] for p in points])
+    lon = np.array([p[2] for p in points])
+    row, col = pixel_index(area, lat, lon)
+    found = row >= 0
+
+    # pixel centres, navigated for the matched pixels only
+    pixel_lat = np.full(len(points), np.nan, dtype=np.float32)
+    pixel_lon = np.full(len(points), np.nan, dtype=np.float32)
+    line = adir.line_ul + row * adir.line_res
+    elem = adir.element_ul + col * adir.element_res
+    if found.any():
+        pixel_lat[found], pixel_lon[found] = GoesNav(area.nav).latlon(line[found], elem[found])
+
+    # (points, box pixels) indices of every box, clipped to the image
+    offsets = np.arange(-box, box + 1)
+    shape = (len(points), len(offsets), len(offsets))
+    box_rows = np.broadcast_to(row[:, np.newaxis, np.newaxis] + offsets[:, np.newaxis], shape).reshape(len(points), -1)
+    box_cols = np.broadcast_to(col[:, np.newaxis, np.newaxis] + offsets, shape).reshape(len(points), -1)
+    inside = (found[:, np.newaxis] & (box_rows >= 0) & (box_rows < adir.lines)
+              & (box_cols >= 0) & (box_cols < adir.elements))
+    count = inside.sum(axis=1)
+
+    time = adir.nominal_time.isoformat()
+    rows = []
+    for b, band in enumerate(adir.bands):
+        data = area.data[b]
+        values = np.where(inside, data[np.where(inside, box_rows, 0), np.where(inside, box_cols, 0)], 0).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = values.sum(axis=1) / count
+        low = np.where(inside, values, np.inf).min(axis=1)
+        high = np.where(inside, values, -np.inf).max(axis=1)
+        for p, (name, plat, plon) in enumerate(points):
+            ok = bool(found[p])
+            rows.append({
+                'time': time, 'day': adir.yyyddd, 'hhmmss': adir.hhmmss, 'band': band, 'point': name,
+                'lat': plat, 'lon': plon, 'line': int(line[p]) if ok else '', 'element': int(elem[p]) if ok else '',
+                'pixel_lat': float(pixel_lat[p]) if ok else '', 'pixel_lon': float(pixel_lon[p]) if ok else '',
+                'value': data[row[p], col[p]].item() if ok else '', 'mean': float(mean[p]) if count[p] else '',
+                'min': low[p].item() if count[p] else '', 'max': high[p].item() if count[p] else '',
+                'count': int(count[p]),
+            })
+    return rows
+
+
+async def extract(host=None, project=0, user='XXXX', requests=None, points=None, output=None, box=1, margin=16,
+                  concurrency=4, retries=3, pool_size=None):
+    '''
+    Fetch the sub-sector around points from every request and append the rows to the output CSV
+
+    The sector comes from a one pixel probe of the first request. Returns
+    (number of rows written, list of failed request summaries).
+    '''
+    semaphore = asyncio.Semaphore(concurrency)
+    pool = AddePool(project=project, user=user, size=pool_size or concurrency)
+    new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+    failed = []
+    written = 0
+
+    with open(output, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        if new_file:
+            writer.writeheader()
+
+        async with pool:
+            probe_kwargs = {k: v for k, v in requests[0].items() if k != 'file'}
+            probe_kwargs.update(nlines=1, nelems=1)
+            probe, _ = await fetch_with_retries(host=host, project=project, user=user, kwargs=probe_kwargs,
+                                                retries=retries, semaphore=semaphore, pool=pool)
+            if isinstance(probe, Exception):
+                raise probe
+            sector = sector_request(probe, points, margin)
+            logger.info(f'Sector {sector}')
+
+            async def run(n, kwargs):
+                nonlocal written
+                current_request.set(n)
+                kwargs = dict({k: v for k, v in kwargs.items() if k != 'file'}, **sector)
+                result, attempt = await fetch_with_retries(host=host, project=project, user=user, kwargs=kwargs,
+                                                           retries=retries, semaphore=semaphore, pool=pool)
+                try:
+                    if isinstance(result, Exception):
+                        raise result
+                    with metrics.stage('extract', points=len(points)):
+                        rows = point_rows(result, points, box)
+                except Exception as err:
+                    failed.append({'request_id': n, 'request': kwargs, 'attempts': attempt + 1, 'error': str(err)})
+                    logger.info(f'FAILED request {n}: {err}')
+                    return
+                for r in rows:
+                    writer.writerow(dict(r, request_id=n))
+                f.flush()
+                written += len(rows)
+
+            await asyncio.gather(*(run(n, r) for n, r in enumerate(requests)))
+    return written, failed
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    logger.setLevel('INFO')
+    if len(sys.argv) < 2 or any(a in ('-h', '--help') for a in sys.argv[1:]):
+        print(doc)
+        sys.exit(0 if len(sys.argv) > 1 else 1)
+    clargs = dict((s.split('=', 1) + [None])[:2] for s in sys.argv[1:])
+    for required in ('host', 'group', 'output'):
+        if required not in clargs:
+            raise KeyError(f'{required} must be specified')
+
+    host = clargs.pop('host')
+    username = clargs.pop('user', 'XXXX')
+    prj = clargs.pop('project', 0)
+    output = clargs.pop('output')
+    points = read_points(clargs.pop('points', None), clargs.pop('stations', None))
+    if not points:
+        raise KeyError('points or stations must be specified')
+    box = int(clargs.pop('box', 1))
+    margin = int(clargs.pop('margin', 16))
+    concurrency = int(clargs.pop('concurrency', 4))
+    retries = int(clargs.pop('retries', 3))
+    connections = int(clargs.pop('connections', concurrency))
+    metrics_file = clargs.pop('metrics', None)
+    batch_args = {k: clargs.pop(k, None) for k in ('days', 'times', 'bands', 'positions')}
+    if 'manifest' in clargs:
+        requests = read_manifest(clargs.pop('manifest'), clargs)
+    else:
+        requests = expand_requests(clargs, **batch_args)
+
+    then = datetime.datetime.now()
+    logger.info(f'{len(points)} points from {len(requests)} requests, {concurrency} in flight')
+    written, failed = asyncio.run(extract(host=host, project=prj, user=username, requests=requests, points=points,
+                                          output=output, box=box, margin=margin, concurrency=concurrency,
+                                          retries=retries, pool_size=connections))
+    logger.info(f'{written} rows, {len(failed)} failed requests, total run time {datetime.datetime.now() - then}')
+    if metrics_file:
+        metrics.dump(metrics_file)
+    sys.exit(1 if failed else 0)
@@ -10,48 +10,102 @@ import datetime
 from matplotlib import pyplot as plt
 import projections
 from pyresample import geometry
-from write_netcdf import nav_transform, write
-import math
+from write_netcdf import nav_transform, write, append
+from spacing import nn_radius
+from filecache import FileCache, cache_key
+from mmaparea import MappedAreaFile
+from areastream import feed_stream, replay
+import numpy as np
+import os
+import tempfile
+from addepool import AddePool
+from metrics import metrics, current_request
+from render import render_projections, render_pool
 import warnings
 import typing
 import json
+import itertools
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 
-MISSING_VALUE = 2143289344 # defined by mcidas
-
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371
-    lat1 = math.radians(lat1)
-    lon1 = math.radians(lon1)
-    lat2 = math.radians(lat2)
-    lon2 = math.radians(lon2)
-
-    x1 = lat2 - lat1
-    y1 = lon2 - lon1
-
-    a = math.sin(x1 / 2)**2 + math.cos(lat2) * math.cos(lat1) * math.sin(y1 / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
-
-def nn_radius(lat, lon):
-    mid = int(len(lat) / 2)
-    srt_idx = None
-    for i in range(len(lat)):
-        if lat[mid][i] != MISSING_VALUE:
-            srt_idx = i
-            break
-    
-    if not srt_idx:
-        return 50000
+logger = logging.getLogger("client")
+
+
+def area_cache_key(host, kwargs):
+    '''Cache key from the normalized request, None if the request has no day and so is relative to live data'''
+    params = {k.lower(): str(v).strip().upper() for k, v in kwargs.items() if k.lower() != 'file' and v is not None}
+    if 'day' not in params:
+        return None
+    return cache_key('area', host.lower(), sorted(params.items()))
+
 
-    sum = 0
-    for i in range(srt_idx, srt_idx + 10):
-        sum += haversine(lat[mid][i], lon[mid][i], lat[mid][i+1], lon[mid][i+1])
-    return (sum / 10) * 1000
+def area_bytes(area_file):
+    '''Size of the image data in an AreaFile, used as the bytes transferred'''
+    adir = area_file.directory
+    return adir.lines * (adir.line_prefix_length + adir.elements * adir.bytes_per_element * adir.spectral_band_count)
 
 
-async def process(host=None, project=0, user='XXXX', kwargs=None):
+async def process(host=None, project=0, user='XXXX', kwargs=None, pool=None, area_cache=None, refresh=False,
+                  stream=False, on_lines=None):
+    '''
+    Fetch one request, from the AREA cache when it has it
+
+    With stream the response goes straight to disk through fetch_stream, to
+    file= or else a temporary file, and comes back memory-mapped. on_lines
+    is passed on to fetch_stream.
+    '''
+    with metrics.stage('fetch', host=host, cache_hit=False, streamed=stream) as m:
+        key = area_cache_key(host, kwargs) if area_cache is not None else None
+        if key is not None and not refresh:
+            hit = area_cache.load(key)
+            if hit is not None:
+                content = hit[0]['area']
+                if kwargs.get('file'):
+                    with open(kwargs['file'], 'wb') as f:
+                        content.tofile(f)
+                logger.debug(f'AREA cache hit {key}')
+                m['cache_hit'] = True
+                m['bytes'] = content.size
+                # served straight from the memory-mapped cache entry, no copy
+                return MappedAreaFile(content)
+
+        # the AREA bytes are cached from the file= copy the client saves,
+        # a streamed file is memory-mapped so the temporary copy can go straight away
+        tmp = None
+        if (key is not None or stream) and not kwargs.get('file'):
+            fd, tmp = tempfile.mkstemp(prefix='.AREA', dir=area_cache.directory if key is not None else None)
+            os.close(fd)
+            kwargs = dict(kwargs, file=tmp)
+
+        try:
+            if stream:
+                area_file = await fetch_stream(host=host, project=project, user=user, kwargs=kwargs, pool=pool,
+                                               on_lines=on_lines)
+            else:
+                area_file = await fetch(host=host, project=project, user=user, kwargs=kwargs, pool=pool)
+            if isinstance(area_file, Exception):
+                m['error'] = str(area_file)
+                return area_file
+            m['bytes'] = area_bytes(area_file)
+            if key is not None:
+                area_cache.save(key, {'area': np.memmap(kwargs['file'], dtype=np.uint8, mode='r')})
+            return area_file
+        finally:
+            if tmp is not None:
+                os.remove(tmp)
+
+
+async def fetch(host=None, project=0, user='XXXX', kwargs=None, pool=None):
+    if pool is not None:
+        try:
+            return await pool.aget(host, **kwargs)
+        except Exception as e:
+            logger.error(e)
+            return e
+
     try:
         async with AddeClient(host=host, project=project, user=user) as c:
             try:
@@ -65,18 +119,270 @@ async def process(host=None, project=0, user='XXXX', kwargs=None):
         logger.error(ee)
         return ee
     
-async def collect(hosts=None, project=0, user='XXXX', kwargs=None):
+@functools.cache
+def warn_no_stream(client_name):
+    '''Warn once per client type that stream=YES cannot bound its memory'''
+    logger.warning(f'{client_name} has no astream method, streamed requests fall back to aget, '
+                   f'which holds each whole AREA response in memory')
+
+
+async def stream_to_file(client, kwargs, on_lines=None, block_lines=64):
+    '''Save the response to kwargs['file'] as it arrives, returns it memory-mapped'''
+    filename = kwargs['file']
+    if hasattr(client, 'astream'):
+        request = {k: v for k, v in kwargs.items() if k != 'file'}
+        with open(filename, 'wb') as f:
+            await feed_stream(client.astream(**request), file=f, on_lines=on_lines, block_lines=block_lines)
+    else:
+        # the client has no byte stream, it saves file= itself and the lines are read back from disk
+        warn_no_stream(type(client).__name__)
+        await client.aget(**kwargs)
+        if on_lines is not None:
+            replay(filename, on_lines, block_lines=block_lines)
+    return MappedAreaFile(filename)
+
+
+async def fetch_stream(host=None, project=0, user='XXXX', kwargs=None, pool=None, on_lines=None, block_lines=64):
+    '''
+    Fetch one request to its file=, parsing the bytes as they arrive when the client can stream them
+
+    Clients with an astream(**kwargs) method, an async iterator of the AREA
+    bytes, are parsed as the bytes arrive (areastream.AreaStream), so only
+    the head and one block of lines are held per request and
+    on_lines(stream, start, block) gets each block_lines lines as they
+    complete. Other clients, pyadde's AddeClient among them, hold the whole
+    response in memory while they save file=, a warning is logged and file=
+    is read back a block at a time.
+    Returns a MappedAreaFile of file=, or the exception as fetch does.
+    '''
+    if pool is not None:
+        try:
+            client = await pool.acquire(host)
+        except Exception as e:
+            logger.error(e)
+            return e
+        try:
+            area_file = await stream_to_file(client, kwargs, on_lines, block_lines)
+        except Exception as e:
+            await pool.release(host, client, healthy=False)
+            logger.error(e)
+            return e
+        await pool.release(host, client)
+        return area_file
+
+    try:
+        async with AddeClient(host=host, project=project, user=user) as c:
+            return await stream_to_file(c, kwargs, on_lines, block_lines)
+    except Exception as e:
+        logger.error(e)
+        return e
+
+
+async def collect(hosts=None, project=0, user='XXXX', kwargs=None, pool=None, area_cache=None, refresh=False,
+                  stream=False):
     tasks = list()
     for h in hosts:
-        taks = asyncio.ensure_future(process(host=h, user=user, project=project, kwargs=kwargs))
+        taks = asyncio.ensure_future(process(host=h, user=user, project=project, kwargs=kwargs, pool=pool,
+                                             area_cache=area_cache, refresh=refresh, stream=stream))
         tasks.append(taks)
     return await asyncio.gather(*tasks, return_exceptions=True)
 
 
+def parse_day(day):
+    '''Parse ccyyddd, yyddd or yyyy-mm-dd into a date'''
+    day = day.strip()
+    if '-' in day:
+        return datetime.datetime.strptime(day, '%Y-%m-%d').date()
+    if len(day) == 5:
+        day = f'19{day}'
+    return datetime.datetime.strptime(day, '%Y%j').date()
+
+
+def expand_days(days):
+    '''Expand a day range "start end" or comma separated days into a list of ccyyddd strings'''
+    if ',' in days or len(days.split()) == 1:
+        return [parse_day(d).strftime('%Y%j') for d in days.split(',')]
+    start, end = (parse_day(d) for d in days.split())
+    return [(start + datetime.timedelta(days=i)).strftime('%Y%j') for i in range((end - start).days + 1)]
+
+
+def expand_positions(positions):
+    '''Expand a position range "start end" or comma separated positions into a list of ints'''
+    if ',' in positions or len(positions.split()) == 1:
+        return [int(p) for p in positions.split(',')]
+    start, end = (int(p) for p in positions.split())
+    step = 1 if end >= start else -1
+    return list(range(start, end + step, step))
+
+
+def expand_requests(kwargs, days=None, times=None, bands=None, positions=None):
+    '''
+    Expand day, time window, band and position lists into one aget kwargs dict per image
+
+    times is a comma separated list of time windows, each "stime etime" or a single time
+    '''
+    day_list = expand_days(days) if days else [kwargs.get('day')]
+    time_list = [(t.split() + t.split())[:2] for t in times.split(',')] if times else [(kwargs.get('stime'), kwargs.get('etime'))]
+    band_list = bands.split(',') if bands else [kwargs.get('band')]
+    pos_list = expand_positions(positions) if positions else [kwargs.get('position')]
+
+    requests = []
+    for day, (stime, etime), band, pos in itertools.product(day_list, time_list, band_list, pos_list):
+        r = dict(kwargs)
+        r.update(day=day, stime=stime, etime=etime, band=band, position=pos)
+        requests.append({k: v for k, v in r.items() if v is not None})
+    return requests
+
+
+def read_manifest(filename, kwargs):
+    '''Read a JSON lines manifest, each line holds request arguments that override kwargs'''
+    requests = []
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                r = dict(kwargs)
+                r.update(json.loads(line))
+                requests.append(r)
+    return requests
+
+
+async def fetch_with_retries(host=None, project=0, user='XXXX', kwargs=None, retries=3, semaphore=None, pool=None,
+                             area_cache=None, refresh=False, stream=False):
+    '''
+    Run process() for one request, retrying with exponential backoff
+
+    The semaphore is held for each attempt only, so a request waiting to
+    retry does not keep other requests from running.
+    '''
+    for attempt in range(retries + 1):
+        async with semaphore:
+            result = await process(host=host, project=project, user=user, kwargs=kwargs, pool=pool,
+                                   area_cache=area_cache, refresh=refresh, stream=stream)
+        if not isinstance(result, Exception):
+            return result, attempt
+        if attempt < retries:
+            await asyncio.sleep(2**attempt)
+    return result, attempt
+
+
+def audit_string(kwargs):
+    '''Command line equivalent of a single request, stored in the netCDF audit trail'''
+    return './fetchfile.py ' + ' '.join(f'{k}={v}' for k, v in kwargs.items())
+
+
+def process_image(n, kwargs, area_file, netcdf=None, transform_area=False, nav_cache=None, render=None, outdir='.',
+                  plan_dir=None, nav_workers=None, nav_step=None, bbox=None, grid_width=None, levels=None,
+                  append_cube=False, workers=None, renderers=None):
+    '''
+    Navigate, write and render one fetched image, returns the status fields to add to its summary
+
+    With append_cube the image is appended to the netCDF time cube netcdf
+    names, which is only navigated when the cube is new or the image is rendered.
+    renderers is a render.render_pool shared by the images of a batch.
+    '''
+    status = {}
+    if not transform_area:
+        raise ValueError('netCDF and projection output need a navigable AGOES01 - AGOES07 group')
+    filename = netcdf.format(n=n, **kwargs) if netcdf else None
+    if append_cube and filename and not render and os.path.exists(filename):
+        lat = lon = None
+    else:
+        lat, lon, proj_lat, proj_lon = nav_transform(area_file, cache=nav_cache, workers=nav_workers, step=nav_step)
+    if append_cube and filename:
+        status['netcdf'] = filename
+        status['time_index'] = append(area_file, lat, lon, filename=filename, audit_str=audit_string(kwargs))
+    elif netcdf:
+        status['netcdf'] = filename
+        write(area_file, lat, lon, filename=filename, audit_str=audit_string(kwargs))
+    if render:
+        with metrics.stage('render', codes=render):
+            status['png'] = render_projections(area_file, lat, lon, proj_lat, proj_lon, nn_radius(lat, lon),
+                                               render, outdir, workers=workers, plan_dir=plan_dir, bbox=bbox,
+                                               width=grid_width, levels=levels, pool=renderers)
+    return status
+
+
+async def batch_collect(host=None, project=0, user='XXXX', requests=None, concurrency=4, retries=3,
+                        netcdf=None, transform_area=False, nav_cache=None, pool_size=None, area_cache=None,
+                        refresh=False, render=None, outdir='.', plan_dir=None, nav_workers=None, nav_step=None, bbox=None,
+                        grid_width=None, levels=None, image_workers=2, max_pending=None, append_cube=False,
+                        stream=False, workers=None):
+    '''
+    Fetch every request with at most concurrency requests in flight, over
+    pool_size pooled connections (default one per request in flight)
+
+    Each image is navigated, written and rendered by one of image_workers
+    threads as soon as it arrives, so downloads carry on meanwhile. At most
+    max_pending images (default concurrency + image_workers) are fetched but
+    not yet processed, later requests wait for a slot before fetching.
+
+    file= and netcdf= are str.format templates filled in from each request,
+    e.g. file=AREA_{day}_{band}_{position}. With append_cube every request
+    is appended to the netCDF time cube its netcdf= name formats to, e.g.
+    netcdf=cube_{band}.nc. With stream each response is written to disk as
+    it arrives and processed memory-mapped, see fetch_stream. Returns one
+    summary dict per request.
+    '''
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = asyncio.Semaphore(max_pending or concurrency + image_workers)
+    pool = AddePool(project=project, user=user, size=pool_size or concurrency)
+    executor = ThreadPoolExecutor(max_workers=image_workers, thread_name_prefix='image')
+    # one set of rendering processes for the whole batch
+    renderers = render_pool(workers or len(render), plan_dir) if render else None
+    loop = asyncio.get_running_loop()
+    total = len(requests)
+    summary = []
+
+    async def run(n, kwargs):
+        current_request.set(n)
+        kwargs = dict(kwargs)
+        if 'file' in kwargs:
+            kwargs['file'] = kwargs['file'].format(n=n, **kwargs)
+        then = datetime.datetime.now()
+        async with pending:
+            result, attempt = await fetch_with_retries(host=host, project=project, user=user, kwargs=kwargs,
+                                                       retries=retries, semaphore=semaphore, pool=pool,
+                                                       area_cache=area_cache, refresh=refresh, stream=stream)
+            status = {'request_id': n, 'request': kwargs, 'attempts': attempt + 1,
+                      'ok': not isinstance(result, Exception)}
+            if status['ok'] and (netcdf or render):
+                # copy the context so metrics recorded in the worker thread keep the request id
+                work = functools.partial(contextvars.copy_context().run, process_image, n, kwargs, result,
+                                         netcdf=netcdf, transform_area=transform_area, nav_cache=nav_cache,
+                                         render=render, outdir=outdir, plan_dir=plan_dir, nav_workers=nav_workers,
+                                         nav_step=nav_step, bbox=bbox, grid_width=grid_width, levels=levels,
+                                         append_cube=append_cube, workers=workers, renderers=renderers)
+                try:
+                    status.update(await loop.run_in_executor(executor, work))
+                except Exception as err:
+                    status['ok'] = False
+                    status['error'] = str(err)
+            elif not status['ok']:
+                status['error'] = str(result)
+        status['seconds'] = (datetime.datetime.now() - then).total_seconds()
+        summary.append(status)
+        logger.info(f'[{len(summary)}/{total}] {"ok" if status["ok"] else "FAILED"} '
+                    f'day={kwargs.get("day")} stime={kwargs.get("stime")} band={kwargs.get("band")} '
+                    f'position={kwargs.get("position")} {status.get("error", "")}')
+
+    try:
+        async with pool:
+            await asyncio.gather(*(run(n, r) for n, r in enumerate(requests)))
+    finally:
+        executor.shutdown(wait=True)
+        if renderers is not None:
+            renderers.shutdown()
+    logger.info(f'ADDE sessions opened {pool.stats["opened"]}, reused {pool.stats["reused"]}')
+    return summary
+
+
 doc = '''
 usage: ./fetchfile.py [-h]
                     host=<host> user=<user> project=<project> group=<group> descriptor=<descriptor> band=<band> 
-                    position=<position> [file=<file>] [netcdf=<netcdf>] [coord_type=<coord_type>] [coord_pos=<coord_pos>]
+                    position=<position> [file=<file>] [netcdf=<netcdf>] [append=<append>] [navcache=<navcache>] [plancache=<plancache>] [areacache=<areacache>] [refresh=<refresh>] [cachesize=<cachesize>]
+                    [render=<render>] [outdir=<outdir>] [workers=<workers>] [navworkers=<navworkers>] [navstep=<navstep>] [bbox=<bbox>]
+                    [gridwidth=<gridwidth>] [levels=<levels>] [metrics=<metrics>]
+                    [coord_type=<coord_type>] [coord_pos=<coord_pos>]
                     [coord_start_dim1=<coord_start_dim1>] [coord_start_dim2=<coord_start_dim2>] [nlines=<nlines>] [nelems=<nelems>] 
                     [day=<day>] [stime=<stime>] [etime=<etime>] [aux=<aux>] [spac=<spac>] [cal=<cal>] [lmag=<lmag>] [emag=<emag>] [doc=<doc>]
 
@@ -96,6 +402,22 @@ non-required (default) arguments:
   day                day range to search, str, ccyyddd or yyddd or yyyy-mm-dd, default=None
   file               file name binary AREA file data is saved to, default=None
   netcdf             file name netCDF4 data is saved to, default=None
+  append             YES to append single band images with the same nav block to netcdf as a time cube sharing one
+                     lat/lon grid, default=NO
+  navcache           directory to cache navigation results in between runs, default=None
+  plancache          directory to cache resampling plans in between runs, default=None
+  areacache          directory to cache fetched AREA files in, requests with a day are served from it, default=None
+  refresh            YES to bypass the AREA cache and fetch again, default=NO
+  cachesize          size limit in MB of each cache directory, default=2048
+  render             headless mode, projections to save as PNG instead of displaying, any of G, P, R, M, S, default=None
+  outdir             directory PNG files are saved to in headless mode, default=.
+  workers            number of processes rendering projections in headless mode, default=one per projection
+  navworkers         number of processes navigating the image, default=1
+  navstep            navigate every navstep'th line and element and interpolate the rest, exact near the limb, default=None
+  bbox               lon_min,lat_min,lon_max,lat_max in degrees of the S(ector) projection, default=None
+  gridwidth          width in pixels of the projection grids, height keeps each projection's aspect, default=per projection
+  levels             zoom levels of each projection saved as PNG in headless mode, halving in size, default=None
+  metrics            file name per stage timings are saved to, JSON lines or Prometheus text if it ends in .prom, default=None
   coord_type         (E)ARTH, (I)mage, or (A)rea, default=A
   coord_pos          (C)entered or (U)pper, default=U
   coord_start_dim1   lat or line number, default=None
@@ -113,26 +435,43 @@ non-required (default) arguments:
 
 options:
   -h, --help         show this help message and exit
+  -b, --batch        non-interactive batch mode, fetch every combination of the batch arguments below
+
+batch arguments (with -b):
+  days               day range "start end" or comma separated days, ccyyddd or yyyy-mm-dd
+  times              comma separated time windows, each "stime etime" or a single time
+  bands              comma separated bands
+  positions          position range "start end" or comma separated positions
+  manifest           JSON lines file, one request per line, keys override the other arguments
+  concurrency        number of requests in flight, default=4
+  retries            number of retries per request, default=3
+  connections        number of pooled ADDE connections to the host, default=concurrency
+  summary            file name the JSON summary of every request is saved to, default=None
+  imageworkers       number of threads navigating, writing and rendering fetched images while downloads go on, default=2
+  maxpending         number of images fetched or being fetched but not yet processed, default=concurrency+imageworkers
+  file and netcdf are templates in batch mode, e.g. file=AREA_{day}_{band}_{position}
+  with append=YES, requests whose netcdf name is the same are appended to one file, e.g. netcdf=cube_{band}.nc
 '''
 
 if __name__ == "__main__":
-    logger = logging.getLogger("client")
     logger.setLevel('DEBUG')
 
     args = sys.argv
+    batch = False
     try:
-        opts, _ = getopt.getopt(args[1:], ':hi', ['help', 'interactive'])
-        if opts:
-            opts = opts[0]
-            if opts[0] in ('-h', '--help'):
+        opts, _ = getopt.getopt(args[1:], ':hib', ['help', 'interactive', 'batch'])
+        for opt, _ in opts:
+            if opt in ('-h', '--help'):
                 print(doc)
                 sys.exit(0)
+            if opt in ('-b', '--batch'):
+                batch = True
     except getopt.GetoptError:
         pass
     
 
     if len(args) > 1:
-        clargs = dict((s.split('=') + [None])[:2] for s in args[1:])
+        clargs = dict((s.split('=', 1) + [None])[:2] for s in args[1:] if not s.startswith('-'))
     else:
         logger.debug("Arguments expected")
         print(doc)
@@ -156,30 +495,109 @@ if __name__ == "__main__":
     username = 'XXXX'
     prj = 0
     netcdf = None
+    nav_cache = None
+    plan_cache = None
+    area_cache = None
     if 'user' in clargs:
         username = clargs.pop('user')
     if 'project' in clargs:
         prj = clargs.pop('project')
     if 'netcdf' in clargs:
         netcdf = clargs.pop('netcdf')
+    append_cube = clargs.pop('append', 'NO').upper() == 'YES'
+    save_netcdf = append if append_cube else write
+    cache_bytes = int(clargs.pop('cachesize', 2048)) * 1024**2
+    refresh = clargs.pop('refresh', 'NO').upper() == 'YES'
+    if 'navcache' in clargs:
+        nav_cache = FileCache(clargs.pop('navcache'), max_bytes=cache_bytes)
+    if 'plancache' in clargs:
+        plan_cache = FileCache(clargs.pop('plancache'), max_bytes=cache_bytes)
+    if 'areacache' in clargs:
+        area_cache = FileCache(clargs.pop('areacache'), max_bytes=cache_bytes)
+    render = clargs.pop('render', None)
+    outdir = clargs.pop('outdir', '.')
+    workers = clargs.pop('workers', None)
+    workers = int(workers) if workers else None
+    nav_workers = int(clargs.pop('navworkers', 1))
+    nav_step = int(clargs.pop('navstep', 0)) or None
+    bbox = clargs.pop('bbox', None)
+    grid_width = int(clargs.pop('gridwidth', 0)) or None
+    levels = int(clargs.pop('levels', 0)) or None
+    if bbox:
+        bbox = tuple(float(v) for v in bbox.split(','))
+    metrics_file = clargs.pop('metrics', None)
+    plans = projections.PlanCache(cache=plan_cache)
+
+    if batch:
+        logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+        logger.setLevel('INFO')
+        concurrency = int(clargs.pop('concurrency', 4))
+        retries = int(clargs.pop('retries', 3))
+        connections = int(clargs.pop('connections', concurrency))
+        summary_file = clargs.pop('summary', None)
+        image_workers = int(clargs.pop('imageworkers', 2))
+        max_pending = int(clargs.pop('maxpending', 0)) or None
+        batch_args = {k: clargs.pop(k, None) for k in ('days', 'times', 'bands', 'positions')}
+        if 'manifest' in clargs:
+            requests = read_manifest(clargs.pop('manifest'), clargs)
+        else:
+            requests = expand_requests(clargs, **batch_args)
+
+        then = datetime.datetime.now()
+        logger.info(f'Batch of {len(requests)} requests, {concurrency} in flight')
+        summary = asyncio.run(batch_collect(host=adde_server, project=prj, user=username, requests=requests,
+                                            concurrency=concurrency, retries=retries, netcdf=netcdf,
+                                            transform_area=transform_area, nav_cache=nav_cache,
+                                            pool_size=connections, area_cache=area_cache, refresh=refresh,
+                                            render=render, outdir=outdir, nav_workers=nav_workers, nav_step=nav_step, bbox=bbox,
+                                            grid_width=grid_width, levels=levels,
+                                            image_workers=image_workers, max_pending=max_pending, append_cube=append_cube,
+                                            workers=workers,
+                                            plan_dir=plan_cache.directory if plan_cache else None))
+        failed = [s for s in summary if not s['ok']]
+        logger.info(f'{len(summary) - len(failed)} ok, {len(failed)} failed, total run time {datetime.datetime.now() - then}')
+        if summary_file:
+            with open(summary_file, 'w') as f:
+                json.dump(summary, f, indent=1)
+        if metrics_file:
+            metrics.dump(metrics_file)
+        sys.exit(1 if failed else 0)
 
     then = datetime.datetime.now()
     loop = asyncio.new_event_loop()
     try:
-        f = collect(hosts=[adde_server], user=username, project=prj, kwargs=clargs)
+        f = collect(hosts=[adde_server], user=username, project=prj, kwargs=clargs, area_cache=area_cache, refresh=refresh)
         a = loop.run_until_complete(f)
+        if render:
+            plt.switch_backend('Agg')
         for e in a:
             if isinstance(e, Exception):
                 continue
             try:
+                if render:
+                    if not transform_area:
+                        logger.error('Projections need a navigable AGOES01 - AGOES07 group')
+                        continue
+                    lat, lon, proj_lat, proj_lon = nav_transform(e, cache=nav_cache, workers=nav_workers, step=nav_step)
+                    if netcdf:
+                        save_netcdf(e, lat, lon, filename=netcdf, audit_str=' '.join(args))
+                    with metrics.stage('render', codes=render):
+                        files = render_projections(e, lat, lon, proj_lat, proj_lon, nn_radius(lat, lon), render, outdir,
+                                                   workers=workers, plan_dir=plan_cache.directory if plan_cache else None,
+                                                   bbox=bbox, width=grid_width, levels=levels)
+                    logger.info(f'Wrote {", ".join(files)}')
+                    continue
+
                 logger.info('Drawing AreaFile')
 
-                d = e.data[0]
-                fig = plt.figure(1, figsize=(10,10))
-                plt.title(f'Band {e.directory.bands[0]}')
-                plt.xticks([]) 
-                plt.yticks([])
-                plt.imshow(d, cmap='gist_gray')
+                num_bands = len(e.directory.bands)
+                fig = plt.figure(1, figsize=(10 * num_bands, 10))
+                for b in range(num_bands):
+                    plt.subplot(1, num_bands, b + 1)
+                    plt.title(f'Band {e.directory.bands[b]}')
+                    plt.xticks([]) 
+                    plt.yticks([])
+                    plt.imshow(e.data[b], cmap='gist_gray')
                 
                 if transform_area:
                     plt.show(block=False)
@@ -190,45 +608,50 @@ if __name__ == "__main__":
                 
                 
                 try:    
-                    proj = {'G': 'Geostationary', 'P': 'Plate Carree', 'R': 'Robinson', 'M': 'Mollweide'}
+                    proj = {'G': 'Geostationary', 'P': 'Plate Carree', 'R': 'Robinson', 'M': 'Mollweide', 'S': 'Sector'}
                     logger.debug('Starting nav transform')
-                    now = datetime.datetime.now()
-                    lat, lon, proj_lat, proj_lon = nav_transform(e)
-                    logger.debug(f'{datetime.datetime.now() - now}')
+                    lat, lon, proj_lat, proj_lon = nav_transform(e, cache=nav_cache, workers=nav_workers, step=nav_step)
                     
                     radius = nn_radius(lat, lon) 
                     arg_str = ' '.join(args) # turn list of cla's to string
                     if netcdf:
                         logger.debug(f'Writing netCDF file: {netcdf}')
                         arg_str = ' '.join(args) # turn list of cla's to string 
-                        write(e, lat, lon, filename=netcdf, audit_str=arg_str) 
+                        save_netcdf(e, lat, lon, filename=netcdf, audit_str=arg_str) 
 
                     swath_def = geometry.SwathDefinition(lons=lon, lats=lat)
+                    grid = {'width': grid_width} if grid_width else {}
                     print('Projections: ')
                     print('\t(G)eostationary')
                     print('\t(P)late Carree')
                     print('\t(R)obinson')
                     print('\t(M)ollweide')
+                    if bbox:
+                        print('\t(S)ector')
                     print()
                     while True:
-                        i = input('Specify projection (G, P, R, M) or press Q to quit: ') 
+                        i = input('Specify projection (G, P, R, M, S) or press Q to quit: ') 
                         match i:
                             case 'G' | 'g':
                                 i = i.upper()
                                 logger.info(f'Drawing {proj[i]} Projection')
-                                data, crs, extent = projections.geostationary(swath_def, e.data[0], proj_lat, proj_lon, radius)
+                                data, crs, extent = projections.geostationary(swath_def, e.data[0], proj_lat, proj_lon, radius, plans=plans, **grid)
                             case 'P' | 'p':
                                 i = i.upper()
                                 logger.info(f'Drawing {proj[i]} Projection')
-                                data, crs, extent = projections.plate_carree(swath_def, e.data[0], proj_lat, proj_lon, radius)
+                                data, crs, extent = projections.plate_carree(swath_def, e.data[0], proj_lat, proj_lon, radius, plans=plans, **grid)
                             case 'R' | 'r':
                                 i = i.upper()
                                 logger.info(f'Drawing {proj[i]} Projection')
-                                data, crs, extent = projections.robinson(swath_def, e.data[0], proj_lat, proj_lon, radius)
+                                data, crs, extent = projections.robinson(swath_def, e.data[0], proj_lat, proj_lon, radius, plans=plans, **grid)
                             case 'M' | 'm':
                                 i = i.upper()
                                 logger.info(f'Drawing {proj[i]} Projection')
-                                data, crs, extent = projections.mollweide(swath_def, e.data[0], proj_lat, proj_lon, radius)
+                                data, crs, extent = projections.mollweide(swath_def, e.data[0], proj_lat, proj_lon, radius, plans=plans, **grid)
+                            case 'S' | 's' if bbox:
+                                i = i.upper()
+                                logger.info(f'Drawing {proj[i]} Projection')
+                                data, crs, extent = projections.sector(swath_def, e.data[0], proj_lat, proj_lon, radius, plans=plans, bbox=bbox, **grid)
                             case 'Q' | 'q':
                                 plt.close()
                                 break
@@ -236,7 +659,7 @@ if __name__ == "__main__":
                                 logger.info('Invalid projection')
                                 continue
 
-                        ax = projections.plot(data, crs, extent, figtitle=f'{proj[i]} Projection')
+                        ax = projections.plot(data, crs, extent, figtitle=f'{proj[i]} Projection', regional=i == 'S')
                         plt.tight_layout()
                         plt.show(block=False)
 
@@ -270,3 +693,5 @@ if __name__ == "__main__":
         loop.close()
         now = datetime.datetime.now()
         logger.info(f'Total run time {now-then}')
+        if metrics_file:
+            metrics.dump(metrics_file)
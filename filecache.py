@@ -0,0 +1,112 @@
+'''
+On-disk cache of numpy arrays
+Each entry is a directory of .npy files plus a json metadata file
+Entries are read back memory-mapped and evicted least recently used first
+once the cache grows past max_bytes
+'''
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+META_FILE = 'meta.json'
+
+
+def cache_key(*parts):
+    '''Hash any mix of strings, numbers, sequences and arrays into a cache key'''
+    h = hashlib.sha1()
+    for p in parts:
+        if isinstance(p, np.ndarray):
+            h.update(p.tobytes())
+        elif isinstance(p, (list, tuple)):
+            h.update(','.join(str(v) for v in p).encode())
+        else:
+            h.update(str(p).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+class FileCache:
+    '''Directory of cache entries with LRU eviction by total size'''
+
+    def __init__(self, directory, max_bytes=2 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self.path(key))
+
+    def load(self, key, mmap_mode='r'):
+        '''Return (arrays, meta) for key or None on a miss, arrays are memory-mapped'''
+        entry = self.path(key)
+        try:
+            with open(os.path.join(entry, META_FILE)) as f:
+                meta = json.load(f)
+            arrays = {name: np.load(os.path.join(entry, f'{name}.npy'), mmap_mode=mmap_mode)
+                      for name in meta['arrays']}
+        except (OSError, ValueError, KeyError):
+            return None
+
+        os.utime(entry)  # mark as recently used
+        return arrays, meta['meta']
+
+    def save(self, key, arrays, meta=None):
+        '''Store a dict of arrays (and json-able meta) under key, replacing any entry there, then evict old entries'''
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp')
+        try:
+            for name, arr in arrays.items():
+                np.save(os.path.join(tmp, f'{name}.npy'), np.asarray(arr))
+            with open(os.path.join(tmp, META_FILE), 'w') as f:
+                json.dump({'arrays': list(arrays), 'meta': meta or {}}, f)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        # move the old entry aside first, a directory cannot replace a non-empty one
+        old = tmp + '.old'
+        try:
+            os.replace(self.path(key), old)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(tmp, self.path(key))
+        except OSError:
+            # another process stored the same entry in between
+            shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        '''List (mtime, size, key) for every entry, oldest first'''
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = self.path(key)
+            if key.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(entry))
+                entries.append((os.stat(entry).st_mtime, size, key))
+            except OSError:
+                continue
+        return sorted(entries)
+
+    def evict(self):
+        '''Remove least recently used entries until the cache fits in max_bytes'''
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for _, _, key in self.entries():
+            shutil.rmtree(self.path(key), ignore_errors=True)
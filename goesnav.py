@@ -0,0 +1,697 @@
+'''
+Vectorized GOES navigation
+Converted to python/numpy from mcidas nvxgoes.dlm
+Navigates whole line/element arrays instead of one pixel per nvxsae call
+
+Covers the GOES 1 to 7 ('GOES' type) nav block handled by nvxgoes.nvxini/nvxsae.
+The fortran code runs in single precision (REAL*4), this module runs in double
+precision and returns float32, so results agree with nvxsae to within about
+1e-3 degrees on the disk. Pixels within a few pixels of the limb can differ
+more, and a pixel right on the limb can come out on-earth in one and off-earth
+in the other. Use nav_error to measure the difference for a given AreaFile.
+
+GoesNav.latlon_tiepoints trades accuracy for speed on large frames by
+interpolating between navigated tie points, tiepoint_error reports how far it
+is from latlon. LazyNav navigates only the tiles a caller indexes.
+GoesNav.line_elem and pixel_index go the other way, lat/lon to line/element.
+'''
+
+import numpy as np
+
+# earth constants used by nvxgoes (km)
+EMEGA = .26251617           # earth rotation rate, radians per hour
+ASQ = 40683833.48           # semi-major axis squared
+BSQ = 40410330.18           # semi-minor axis squared
+RDPDG = np.pi / 180.0
+
+# orbit constants used by satvec/epoch
+RE = 6378.388
+GRACON = .07436574
+SOLSID = 1.00273791
+SHA = 100.26467             # right ascension of greenwich at IRAYD/IRAHMS
+IRAYD = 74001
+IRAHMS = 0
+
+MISVAL = -2139062144        # 0x80808080, mcidas missing value in nav blocks
+
+
+def flalo(m):
+    '''Convert packed DDDMMSS (or HHMMSS) integer to float degrees (or hours)'''
+    n = abs(int(m))
+    x = n // 10000 + (n // 100 % 100) / 60.0 + (n % 100) / 3600.0
+    return -x if m < 0 else x
+
+
+def iftok(x):
+    '''Convert float hours to packed HHMMSS integer'''
+    sign = -1 if x < 0 else 1
+    x = abs(x)
+    hh = int(x)
+    mm = int((x - hh) * 60)
+    ss = int(round(((x - hh) * 60 - mm) * 60))
+    if ss == 60:
+        ss = 0
+        mm += 1
+    if mm == 60:
+        mm = 0
+        hh += 1
+    return sign * (hh * 10000 + mm * 100 + ss)
+
+
+def icon1(yymmdd):
+    '''Convert YYMMDD to YYDDD'''
+    num = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+    year = yymmdd // 10000 % 100
+    month = yymmdd // 100 % 100
+    day = yymmdd % 100
+    if month < 1 or month > 12:
+        return 0
+    julday = day + num[month - 1]
+    if year % 4 == 0 and month > 2:
+        julday += 1
+    return 1000 * year + julday
+
+
+def _days(yyddd):
+    '''Day count used by mcidas time differences'''
+    year = yyddd // 1000 % 100
+    day = yyddd % 1000
+    return 365 * (year - 1) + (year - 1) // 4 + 1 + day - 1
+
+
+def timdif(yyddd1, hhmmss1, yyddd2, hhmmss2):
+    '''Minutes from yyddd1/hhmmss1 to yyddd2/hhmmss2'''
+    return (_days(yyddd2) - _days(yyddd1)) * 1440.0 + 60.0 * (flalo(hhmmss2) - flalo(hhmmss1))
+
+
+def raerac(yyddd, hhmmss, rae):
+    '''Convert earth longitude to celestial right ascension (degrees)'''
+    raha = rae + timdif(IRAYD, IRAHMS, yyddd, hhmmss) * SOLSID / 4.0 + SHA
+    rac = raha % 360.0
+    return rac + 360.0 if rac < 0 else rac
+
+
+def _leapyr(year):
+    return 366 - (year % 4 + 3) // 4
+
+
+def epoch(ietimy, ietimh, semima, oeccen, xmeana):
+    '''Move the orbit epoch to the time of perigee, returns (yyddd, hhmmss)'''
+    xmmc = GRACON * np.sqrt(RE / semima)**3
+    xmanom = RDPDG * xmeana
+    time = flalo(ietimh) - (xmanom - oeccen * np.sin(xmanom)) / (60.0 * xmmc)
+    iday = 0
+    if time > 48.0:
+        time -= 48.0
+        iday = 2
+    elif time > 24.0:
+        time -= 24.0
+        iday = 1
+    elif time < -24.0:
+        time += 48.0
+        iday = -2
+    elif time < 0.0:
+        time += 24.0
+        iday = -1
+    ietimh = iftok(time)
+    if iday == 0:
+        return ietimy, ietimh
+
+    jyear = ietimy // 1000 % 100
+    jday = ietimy % 1000 + iday
+    if jday < 1:
+        jyear -= 1
+        jday = _leapyr(jyear) + jday
+    elif jday > _leapyr(jyear):
+        jday -= _leapyr(jyear)
+        jyear += 1
+    return 1000 * jyear + jday, ietimh
+
+
+def nxyzll(x, y, z):
+    '''Convert earth centered x, y, z (km) to geodetic lat and west positive lon'''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = np.arctan(z / np.sqrt(x * x + y * y))
+    lat = np.arctan2(ASQ * np.sin(a), BSQ * np.cos(a)) / RDPDG
+    lon = -np.arctan2(y, x) / RDPDG
+    return lat, lon
+
+
+def _nav_type(word):
+    '''Decode the nav type from the first nav block word'''
+    if isinstance(word, (bytes, str)):
+        return word.decode() if isinstance(word, bytes) else word
+    word = int(word) & 0xFFFFFFFF
+    return word.to_bytes(4, 'big').decode('ascii', errors='replace')
+
+
+class GoesNav:
+    '''GOES navigation state, equivalent to nvxini(1, nav)'''
+
+    def __init__(self, nav):
+        if _nav_type(nav[0]) not in ('GOES', 'SEOG'):
+            raise ValueError(f'Not a GOES nav block: {_nav_type(nav[0])!r}')
+        iparms = [0, 0] + [int(p) for p in nav[1:]]  # iparms[n] is fortran IPARMS(n)
+
+        self.navday = iparms[2] % 100000
+        if not any(p > 0 for p in iparms[7:13]):
+            raise ValueError('GOES nav block has no orbit parameters')
+        ietimy = icon1(iparms[5])
+        ietimh = 100 * (iparms[6] // 100) + int(round(.6 * (iparms[6] % 100)))
+        self.semima = iparms[7] / 100.0
+        self.oeccen = iparms[8] / 1000000.0
+        self.orbinc = iparms[9] / 1000.0
+        xmeana = iparms[10] / 1000.0
+        self.perhel = iparms[11] / 1000.0
+        self.asnode = iparms[12] / 1000.0
+        self.ietimy, self.ietimh = epoch(ietimy, ietimh, self.semima, self.oeccen, xmeana)
+        if iparms[5] == 0:
+            raise ValueError('GOES nav block has no epoch date')
+
+        declin = flalo(iparms[13])
+        rascen = flalo(iparms[14])
+        self.piclin = float(iparms[15])
+        if iparms[15] >= 1000000:
+            self.piclin /= 10000.0
+        if iparms[13] == 0 and iparms[14] == 0 and iparms[15] == 0:
+            raise ValueError('GOES nav block has no spin axis attitude')
+
+        spinra = iparms[16] / 1000.0
+        if iparms[16] != 0 and spinra < 300.0:
+            spinra = 60000.0 / spinra
+        if iparms[16] == 0:
+            raise ValueError('GOES nav block has no spin rate')
+        deglin = flalo(iparms[17])
+        lintot = iparms[18]
+        degele = flalo(iparms[19])
+        ieltot = iparms[20]
+        pitch = flalo(iparms[21])
+        yaw = flalo(iparms[22])
+        roll = flalo(iparms[23])
+        skew = 0.0 if iparms[29] == MISVAL else iparms[29] / 100000.0
+
+        self.numsen = max((lintot // 100000) % 100, 1)
+        totlin = self.totlin = self.numsen * (lintot % 100000)
+        self.radlin = RDPDG * deglin / (totlin - 1.0)
+        totele = self.totele = float(ieltot)
+        self.radele = RDPDG * degele / (totele - 1.0)
+        self.picele = (1.0 + totele) / 2.0
+
+        pskew = np.arctan2(skew, self.radlin / self.radele)
+        stp, ctp = np.sin(RDPDG * pitch), np.cos(RDPDG * pitch)
+        sty, cty = np.sin(RDPDG * yaw - pskew), np.cos(RDPDG * yaw - pskew)
+        st_r, ct_r = np.sin(RDPDG * roll), np.cos(RDPDG * roll)
+        self.rotm11 = ct_r * ctp
+        self.rotm13 = sty * st_r * ctp + cty * stp
+        self.rotm21 = -st_r
+        self.rotm23 = sty * ct_r
+        self.rotm31 = -ct_r * stp
+        self.rotm33 = cty * ctp - sty * st_r * stp
+        self.tmpscl = spinra / 3600000.0
+
+        dec = declin * RDPDG
+        ras = rascen * RDPDG
+        self.b = np.array([
+            [-np.sin(ras), np.cos(ras), 0.0],
+            [-np.sin(dec) * np.cos(ras), -np.sin(dec) * np.sin(ras), np.cos(dec)],
+            [np.cos(dec) * np.cos(ras), np.cos(dec) * np.sin(ras), np.sin(dec)],
+        ])
+        self.xref = raerac(self.navday, 0, 0.0) * RDPDG
+
+        self.gamma = iparms[39] / 100.0 if len(iparms) > 40 else 0.0
+        self.gamdot = iparms[40] / 100.0 if len(iparms) > 40 else 0.0
+
+        # scan line timing, vas birds carry it in the beta records
+        jtime = iparms[3]
+        ioff = 3
+        iss = iparms[ioff + 1] // 100000
+        if (iss > 25 or iss == 12) and len(iparms) > ioff + 39 and iparms[ioff + 31] > 0:
+            self.scan1 = float(iparms[ioff + 35])
+            self.time1 = flalo(iparms[ioff + 36])
+            self.scan2 = float(iparms[ioff + 38])
+            self.time2 = flalo(iparms[ioff + 39])
+        else:
+            self.scan1 = 1.0
+            self.time1 = flalo(jtime)
+            self.scan2 = float(lintot % 100000)
+            self.time2 = self.time1 + self.scan2 * self.tmpscl
+
+        self._init_orbit()
+
+    def _init_orbit(self):
+        '''Orbit constants from satvec'''
+        o = RDPDG * self.orbinc
+        p = RDPDG * self.perhel
+        a = RDPDG * self.asnode
+        so, co = np.sin(o), np.cos(o)
+        sp, cp = np.sin(p) * self.semima, np.cos(p) * self.semima
+        sa, ca = np.sin(a), np.cos(a)
+        self.p_vec = np.array([cp * ca - sp * sa * co, cp * sa + sp * ca * co, sp * so])
+        self.q_vec = np.array([-sp * ca - cp * sa * co, -sp * sa + cp * ca * co, cp * so])
+        self.srome2 = np.sqrt(1.0 - self.oeccen) * np.sqrt(1.0 + self.oeccen)
+        self.xmmc = GRACON * RE * np.sqrt(RE / self.semima) / self.semima
+        self.tdife = _days(self.navday) * 1440.0 - (_days(self.ietimy) * 1440.0 + 60.0 * flalo(self.ietimh))
+        self.tdifra = _days(self.navday) * 1440.0 - (_days(IRAYD) * 1440.0 + 60.0 * flalo(IRAHMS))
+
+    def satvec(self, samtim):
+        '''Celestial satellite position (km) at hours since start of the nav day'''
+        xmanom = self.xmmc * (self.tdife + np.asarray(samtim, dtype=np.float64) * 60.0)
+        ecanom = xmanom.copy()
+        for _ in range(20):
+            ecanm1 = ecanom
+            ecanom = xmanom + self.oeccen * np.sin(ecanm1)
+            if np.all(np.abs(ecanom - ecanm1) < 1.0e-8):
+                break
+        xomega = np.cos(ecanom) - self.oeccen
+        yomega = self.srome2 * np.sin(ecanom)
+        return tuple(xomega * self.p_vec[i] + yomega * self.q_vec[i] for i in range(3))
+
+    def satpos(self, hhmmss):
+        '''Earth fixed satellite position (km), equivalent to nvxgoes satpos(0, hhmmss)'''
+        x, y, z = self.satvec(np.array([flalo(hhmmss)]))
+        ra = ((self.tdifra + flalo(hhmmss) * 60.0) * SOLSID * np.pi / 720.0 + SHA * RDPDG) % (2 * np.pi)
+        cra, sra = np.cos(ra), np.sin(ra)
+        return float(x[0] * cra + y[0] * sra), float(-x[0] * sra + y[0] * cra), float(z[0])
+
+    def subpoint(self, hhmmss):
+        '''Satellite sub point as (lat, east positive lon)'''
+        lat, lon = nxyzll(*self.satpos(hhmmss))
+        return float(lat), float(-lon)
+
+    def nvxsae(self, lines, elems):
+        '''
+        Navigate line/element arrays, equivalent to calling nvxsae on every pixel
+
+        lines and elems must broadcast against each other, returns float64 lat and
+        west positive lon with NaN where the pixel is off the earth
+        '''
+        lines = np.asarray(lines, dtype=np.float64)
+        elems = np.asarray(elems, dtype=np.float64)
+
+        # satellite position only depends on the scan line, so do the orbit once per line
+        ulines, inverse = np.unique(lines, return_inverse=True)
+        parlin = (np.rint(ulines).astype(np.int64) - 1) // self.numsen + 1
+        samtim = (self.time2 - self.time1) / (self.scan2 - self.scan1) * (parlin - self.scan1) + self.time1
+        xsat, ysat, zsat = self.satvec(samtim)
+        xcor = self.b[0, 0] * xsat + self.b[0, 1] * ysat + self.b[0, 2] * zsat
+        ycor = self.b[1, 0] * xsat + self.b[1, 1] * ysat + self.b[1, 2] * zsat
+        rot = np.arctan2(ycor, xcor) + np.pi
+        ylin = (ulines - self.piclin) * self.radlin
+        coslin, sinlin = np.cos(ylin), np.sin(ylin)
+        ct, st = np.cos(EMEGA * samtim + self.xref), np.sin(EMEGA * samtim + self.xref)
+
+        def per_line(v):
+            return v[inverse].reshape(lines.shape)
+
+        xsat, ysat, zsat, coslin, sinlin, ct, st = (per_line(v) for v in (xsat, ysat, zsat, coslin, sinlin, ct, st))
+        yele = (elems - self.picele + self.gamma + self.gamdot * per_line(samtim)) * self.radele - per_line(rot)
+
+        eli = self.rotm11 * coslin - self.rotm13 * sinlin
+        emi = self.rotm21 * coslin - self.rotm23 * sinlin
+        eni = self.rotm31 * coslin - self.rotm33 * sinlin
+        sinele, cosele = np.sin(yele), np.cos(yele)
+        eli, emi = cosele * eli + sinele * emi, -sinele * eli + cosele * emi
+
+        b = self.b
+        elo = b[0, 0] * eli + b[1, 0] * emi + b[2, 0] * eni
+        emo = b[0, 1] * eli + b[1, 1] * emi + b[2, 1] * eni
+        eno = b[0, 2] * eli + b[1, 2] * emi + b[2, 2] * eni
+
+        # intersect the line of sight with the earth ellipsoid
+        aq = BSQ * (elo * elo + emo * emo) + ASQ * eno * eno
+        bq = 2.0 * ((elo * xsat + emo * ysat) * BSQ + eno * zsat * ASQ)
+        cq = (xsat * xsat + ysat * ysat) * BSQ + ASQ * zsat * zsat - ASQ * BSQ
+        rad = bq * bq - 4.0 * aq * cq
+        off_earth = rad < 1.0
+        s = -(bq + np.sqrt(np.where(off_earth, 1.0, rad))) / (aq + aq)
+        x = xsat + elo * s
+        y = ysat + emo * s
+        z = zsat + eno * s
+
+        lat, lon = nxyzll(ct * x + st * y, -st * x + ct * y, z)
+        lat[off_earth] = np.nan
+        lon[off_earth] = np.nan
+        return lat, lon
+
+    def latlon(self, lines, elems):
+        '''Navigate line/element arrays to float32 lat and east positive lon, NaN off the earth'''
+        lat, lon = self.nvxsae(lines, elems)
+        return lat.astype(np.float32), (-lon).astype(np.float32)
+
+    def latlon_tiepoints(self, lines, elems, step=16, tolerance=0.01):
+        '''
+        Approximate latlon by navigating every step'th line and element and
+        interpolating the pixels in between
+
+        lines is a column and elems a row, as from area_grid. Tie points are
+        interpolated bilinearly as unit vectors so the dateline needs no special
+        case. Cells with all four corners off the earth are space and left NaN.
+        Cells across the limb, and the ring of cells around them, are navigated
+        exactly, so the limb comes out the same as latlon. The centre of every
+        other cell is navigated as a check, cells whose centre is off by more
+        than tolerance degrees are navigated exactly too.
+        '''
+        lat, lon, _ = self._tiepoints(lines, elems, step, tolerance)
+        return lat, lon
+
+    def _tiepoints(self, lines, elems, step, tolerance):
+        '''latlon_tiepoints, plus the number of pixels navigated exactly'''
+        lines = np.asarray(lines, dtype=np.float64).reshape(-1)
+        elems = np.asarray(elems, dtype=np.float64).reshape(-1)
+        if step < 2 or len(lines) <= step or len(elems) <= step:
+            lat, lon = self.latlon(lines[:, np.newaxis], elems[np.newaxis, :])
+            return lat, lon, lat.size
+
+        line_ties, line_cell, line_w = _tie_points(len(lines), step)
+        elem_ties, elem_cell, elem_w = _tie_points(len(elems), step)
+        tie_lat, tie_lon = self.nvxsae(lines[line_ties, np.newaxis], elems[np.newaxis, elem_ties])
+        off = np.isnan(tie_lat)
+
+        # bilinear interpolation of the tie point unit vectors, elements then lines
+        tie_lat, tie_lon = np.where(off, 0.0, tie_lat) * RDPDG, np.where(off, 0.0, tie_lon) * RDPDG
+        vectors = []
+        for v in (np.cos(tie_lat) * np.cos(tie_lon), np.cos(tie_lat) * np.sin(tie_lon), np.sin(tie_lat)):
+            v = (v[:, elem_cell] * (1.0 - elem_w) + v[:, elem_cell + 1] * elem_w).astype(np.float32)
+            w = line_w[:, np.newaxis].astype(np.float32)
+            vectors.append(v[line_cell] * (1.0 - w) + v[line_cell + 1] * w)
+        x, y, z = vectors
+        lat = np.degrees(np.arctan2(z, np.hypot(x, y)))
+        lon = -np.degrees(np.arctan2(y, x))
+
+        # cells across the limb grown by one cell, cells in space are NaN
+        corners_off = off[:-1, :-1].astype(np.int8) + off[1:, :-1] + off[:-1, 1:] + off[1:, 1:]
+        space = corners_off == 4
+        exact = (corners_off > 0) & ~space
+        grown = np.pad(exact, 1)
+        exact |= grown[:-2, 1:-1] | grown[2:, 1:-1] | grown[1:-1, :-2] | grown[1:-1, 2:]
+        space &= ~exact
+        lat[space[line_cell][:, elem_cell]] = np.nan
+        lon[np.isnan(lat)] = np.nan
+
+        # check the centre of every cell with all four corners on the earth
+        check = np.argwhere(~exact & ~space)
+        mid_lines = (line_ties[check[:, 0]] + line_ties[check[:, 0] + 1]) // 2
+        mid_elems = (elem_ties[check[:, 1]] + elem_ties[check[:, 1] + 1]) // 2
+        check_lat, check_lon = self.latlon(lines[mid_lines], elems[mid_elems])
+        dlat = np.abs(lat[mid_lines, mid_elems] - check_lat)
+        dlon = np.abs((lon[mid_lines, mid_elems] - check_lon + 180.0) % 360.0 - 180.0)
+        with np.errstate(invalid='ignore'):
+            failed = ~(np.maximum(dlat, dlon) <= tolerance)
+        exact[check[failed, 0], check[failed, 1]] = True
+
+        exact_pixels = 0
+        for row in np.flatnonzero(exact.any(axis=1)):
+            rows = np.flatnonzero(line_cell == row)
+            cols = np.flatnonzero(exact[row][elem_cell])
+            exact_lat, exact_lon = self.latlon(lines[rows, np.newaxis], elems[np.newaxis, cols])
+            lat[np.ix_(rows, cols)] = exact_lat
+            lon[np.ix_(rows, cols)] = exact_lon
+            exact_pixels += len(rows) * len(cols)
+        return lat, lon, exact_pixels
+
+    def line_elem(self, lat, lon, iterations=10, tolerance=0.05):
+        '''
+        Inverse of latlon, lat and east positive lon arrays to float64 line and element
+
+        Starts from the nearest point of a coarse navigated grid over the whole
+        scan frame and refines with Newton steps on the forward navigation.
+        Points the satellite cannot see, or that do not converge to within
+        tolerance pixels, come back NaN. That includes about 1 in 1000 points
+        lying right on the limb.
+        '''
+        lat, lon = np.broadcast_arrays(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64))
+        shape = lat.shape
+        target = _unit_vectors(lat.reshape(-1), lon.reshape(-1))
+        line, elem = self._first_guess(target)
+        done = np.isnan(line)
+        line[done], elem[done] = 1.0, 1.0
+
+        # Newton steps with the jacobian from one pixel finite differences
+        for _ in range(iterations):
+            active = np.flatnonzero(~done)
+            if not active.size:
+                break
+            al, ae = line[active], elem[active]
+            v0, dl, de = self._jacobian(al, ae)
+            r = target[:, active] - v0
+            # least squares solve of [dl de] [step_line step_elem] = r, 3 equations per point
+            a11, a12, a22 = (dl * dl).sum(0), (dl * de).sum(0), (de * de).sum(0)
+            b1, b2 = (dl * r).sum(0), (de * r).sum(0)
+            det = a11 * a22 - a12 * a12
+            with np.errstate(divide='ignore', invalid='ignore'):
+                step_line = (a22 * b1 - a12 * b2) / det
+                step_elem = (a11 * b2 - a12 * b1) / det
+            ok = np.isfinite(step_line) & np.isfinite(step_elem)
+            step_line, step_elem = np.where(ok, step_line, 0.0), np.where(ok, step_elem, 0.0)
+            # limit the step, and halve it while it lands off the disk near the limb
+            scale = np.minimum(1.0, 32.0 / np.maximum(np.hypot(step_line, step_elem), 1e-12))
+            for _ in range(8):
+                off = ok & np.isnan(self.latlon(al + scale * step_line, ae + scale * step_elem)[0])
+                if not off.any():
+                    break
+                scale = np.where(off, scale / 2, scale)
+            line[active] = al + scale * step_line
+            elem[active] = ae + scale * step_elem
+            done[active] = ~ok | (np.hypot(step_line, step_elem) < tolerance / 10)
+
+        # keep points whose forward navigation lands back on the target
+        v, dl, de = self._jacobian(line, elem)
+        pixel = np.maximum(np.linalg.norm(dl, axis=0), np.linalg.norm(de, axis=0))
+        with np.errstate(invalid='ignore'):
+            good = np.linalg.norm(target - v, axis=0) <= tolerance * pixel
+        line = np.where(good, line, np.nan)
+        elem = np.where(good, elem, np.nan)
+        return line.reshape(shape), elem.reshape(shape)
+
+    def _jacobian(self, line, elem):
+        '''
+        Unit vector at line/elem and its change over one line and one element,
+        differenced backwards where one pixel further is off the disk
+        '''
+        v0 = _unit_vectors(*self.latlon(line, elem))
+        derivatives = []
+        for dline, delem in ((1.0, 0.0), (0.0, 1.0)):
+            d = _unit_vectors(*self.latlon(line + dline, elem + delem)) - v0
+            back = v0 - _unit_vectors(*self.latlon(line - dline, elem - delem))
+            derivatives.append(np.where(np.isnan(d), back, d))
+        return v0, derivatives[0], derivatives[1]
+
+    def _first_guess(self, target, chunk=1024):
+        '''Line and element of the nearest point of a coarse grid over the scan frame'''
+        if not hasattr(self, '_guess_grid'):
+            lines = np.linspace(1.0, self.totlin, 33)
+            elems = np.linspace(1.0, self.totele, 33)
+            grid = _unit_vectors(*self.latlon(lines[:, np.newaxis], elems[np.newaxis, :]))
+            keep = np.isfinite(grid[0])
+            line_grid, elem_grid = np.meshgrid(lines, elems, indexing='ij')
+            self._guess_grid = grid[:, keep], line_grid[keep], elem_grid[keep]
+        grid, line_grid, elem_grid = self._guess_grid
+
+        nearest = np.empty(target.shape[1], dtype=np.int64)
+        for start in range(0, target.shape[1], chunk):
+            t = target[:, start:start + chunk]
+            nearest[start:start + chunk] = np.argmax(t.T @ grid, axis=1)
+        line, elem = line_grid[nearest], elem_grid[nearest]
+        off = ~np.isfinite(target[0])
+        return np.where(off, np.nan, line), np.where(off, np.nan, elem)
+
+
+def _unit_vectors(lat, lon):
+    '''(3, ...) unit vectors of lat/lon in degrees, NaN stays NaN'''
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def _tie_points(n, step):
+    '''
+    Tie point indices along an axis of n pixels (every step'th plus the last),
+    and for every pixel the cell it falls in and its weight towards the next tie point
+    '''
+    ties = np.arange(0, n, step)
+    if ties[-1] != n - 1:
+        ties = np.append(ties, n - 1)
+    index = np.arange(n)
+    cell = np.minimum(np.searchsorted(ties, index, side='right') - 1, len(ties) - 2)
+    weight = (index - ties[cell]) / (ties[cell + 1] - ties[cell])
+    return ties, cell, weight
+
+
+def area_grid(adir):
+    '''Line and element coordinates of every pixel described by an AreaDirectory'''
+    lines = adir.line_ul + np.arange(adir.lines, dtype=np.float64) * adir.line_res
+    elems = adir.element_ul + np.arange(adir.elements, dtype=np.float64) * adir.element_res
+    return lines[:, np.newaxis], elems[np.newaxis, :]
+
+
+class LazyNav:
+    '''
+    Navigation of an AreaFile computed on demand, tile by tile
+
+    lazy[key], lazy.lat[key] and lazy.lon[key] index like 2-D float32 arrays
+    (ints, slices or integer arrays per axis) and only navigate the tiles of
+    tile_shape lines x elements the key touches. Navigated tiles are kept, so
+    overlapping requests are served from memory. np.asarray(lazy.lat)
+    navigates everything.
+    '''
+
+    def __init__(self, area, tile_shape=(64, 64)):
+        self.nav = GoesNav(area.nav)
+        lines, elems = area_grid(area.directory)
+        self.lines, self.elems = lines[:, 0], elems[0]
+        self.shape = (len(self.lines), len(self.elems))
+        self.tile_shape = tile_shape
+        self.tiles = {}
+        self.lat = _LazyComponent(self, 0)
+        self.lon = _LazyComponent(self, 1)
+
+    def __getitem__(self, key):
+        '''(lat, lon) of the pixels selected by key'''
+        rows, cols, shape = self._indices(key)
+        lat = np.empty((len(rows), len(cols)), dtype=np.float32)
+        lon = np.empty((len(rows), len(cols)), dtype=np.float32)
+        th, tw = self.tile_shape
+        self._navigate(np.unique(rows // th), np.unique(cols // tw))
+        row_tiles, col_tiles = rows // th, cols // tw
+        for tr in np.unique(row_tiles):
+            r = np.flatnonzero(row_tiles == tr)
+            for tc in np.unique(col_tiles):
+                c = np.flatnonzero(col_tiles == tc)
+                tile_lat, tile_lon = self.tiles[tr, tc]
+                sub = np.ix_(rows[r] - tr * th, cols[c] - tc * tw)
+                lat[np.ix_(r, c)] = tile_lat[sub]
+                lon[np.ix_(r, c)] = tile_lon[sub]
+        return lat.reshape(shape), lon.reshape(shape)
+
+    def _indices(self, key):
+        '''Row and column indices selected by key, and the shape of the result'''
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2:
+            raise IndexError(f'too many indices for a 2-D navigation grid: {len(key)}')
+        key = key + (slice(None),) * (2 - len(key))
+        indices, shape = [], []
+        for k, n in zip(key, self.shape):
+            index = np.arange(n)[k]
+            if np.ndim(index) == 0:
+                indices.append(np.atleast_1d(index))
+            else:
+                indices.append(index.reshape(-1))
+                shape.append(index.size)
+        return indices[0], indices[1], tuple(shape)
+
+    def _navigate(self, tile_rows, tile_cols):
+        '''Navigate the missing tiles, one latlon call per row of tiles'''
+        th, tw = self.tile_shape
+        for tr in tile_rows:
+            missing = [tc for tc in tile_cols if (tr, tc) not in self.tiles]
+            if not missing:
+                continue
+            lines = self.lines[tr * th:(tr + 1) * th]
+            cols = [np.arange(tc * tw, min((tc + 1) * tw, self.shape[1])) for tc in missing]
+            lat, lon = self.nav.latlon(lines[:, np.newaxis], self.elems[np.concatenate(cols)][np.newaxis, :])
+            start = 0
+            for tc, c in zip(missing, cols):
+                self.tiles[tr, tc] = lat[:, start:start + len(c)], lon[:, start:start + len(c)]
+                start += len(c)
+
+    @property
+    def navigated(self):
+        '''Fraction of the tiles navigated so far'''
+        th, tw = self.tile_shape
+        total = -(-self.shape[0] // th) * -(-self.shape[1] // tw)
+        return len(self.tiles) / total
+
+
+class _LazyComponent:
+    '''lat or lon of a LazyNav'''
+
+    def __init__(self, lazy, component):
+        self.lazy = lazy
+        self.component = component
+        self.shape = lazy.shape
+        self.dtype = np.dtype(np.float32)
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return self.lazy[key][self.component]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:, :]
+        return values if dtype is None else values.astype(dtype)
+
+
+def pixel_index(area, lat, lon):
+    '''
+    Nearest (row, column) of area's arrays to each lat/east positive lon point
+
+    Vectorized through GoesNav.line_elem, -1 where the point is off the disk
+    or outside the image
+    '''
+    adir = area.directory
+    line, elem = GoesNav(area.nav).line_elem(lat, lon)
+    row = np.rint((line - adir.line_ul) / adir.line_res)
+    col = np.rint((elem - adir.element_ul) / adir.element_res)
+    inside = (row >= 0) & (row < adir.lines) & (col >= 0) & (col < adir.elements)
+    return np.where(inside, row, -1).astype(np.int64), np.where(inside, col, -1).astype(np.int64)
+
+
+def nav_error(area, step=10):
+    '''
+    Compare GoesNav against nvxgoes.nvxsae on every step'th line and element
+
+    Returns (max abs lat difference, max abs lon difference, number of pixels
+    that are on-earth in one and off-earth in the other). Needs nvxgoes.
+    '''
+    from nvxgoes import nvxgoes as nvx
+
+    nvx.nvxini(1, area.nav)
+    lines, elems = area_grid(area.directory)
+    lines = lines[::step, 0]
+    elems = elems[0, ::step]
+    lat, lon = GoesNav(area.nav).latlon(lines[:, np.newaxis], elems[np.newaxis, :])
+
+    ref_lat = np.full(lat.shape, np.nan)
+    ref_lon = np.full(lon.shape, np.nan)
+    for i, line in enumerate(lines):
+        for j, elem in enumerate(elems):
+            status, xpar, ypar, _ = nvx.nvxsae(line, elem, 0.0)
+            if status != -1:
+                ref_lat[i, j] = xpar
+                ref_lon[i, j] = -ypar
+
+    mismatch = int(np.count_nonzero(np.isnan(lat) != np.isnan(ref_lat)))
+    both = ~np.isnan(lat) & ~np.isnan(ref_lat)
+    if not both.any():
+        return 0.0, 0.0, mismatch
+    dlon = np.abs((lon[both] - ref_lon[both] + 180.0) % 360.0 - 180.0)
+    return float(np.max(np.abs(lat[both] - ref_lat[both]))), float(np.max(dlon)), mismatch
+
+
+def tiepoint_error(area, step=16, tolerance=0.01, sample=1):
+    '''
+    Compare GoesNav.latlon_tiepoints against exact GoesNav.latlon on every
+    sample'th line
+
+    Returns (max abs lat difference, max abs lon difference, number of pixels
+    that are on-earth in one and off-earth in the other, fraction of pixels
+    navigated exactly), differences in degrees
+    '''
+    nav = GoesNav(area.nav)
+    lines, elems = area_grid(area.directory)
+    lat, lon, exact_pixels = nav._tiepoints(lines, elems, step, tolerance)
+    exact_fraction = exact_pixels / lat.size
+    ref_lat, ref_lon = nav.latlon(lines[::sample], elems)
+    lat, lon = lat[::sample], lon[::sample]
+
+    mismatch = int(np.count_nonzero(np.isnan(lat) != np.isnan(ref_lat)))
+    both = ~np.isnan(lat) & ~np.isnan(ref_lat)
+    if not both.any():
+        return 0.0, 0.0, mismatch, exact_fraction
+    dlon = np.abs((lon[both] - ref_lon[both] + 180.0) % 360.0 - 180.0)
+    return float(np.max(np.abs(lat[both] - ref_lat[both]))), float(np.max(dlon)), mismatch, exact_fraction
@@ -0,0 +1,159 @@
+'''
+Per-stage timing and metrics
+Records wall time, cpu time, bytes, pixels and RSS for each stage of the
+fetch -> navigate -> resample -> write pipeline, tagged with the request it
+belongs to, and emits them as JSON lines or Prometheus text
+
+Stages run in worker processes are recorded there, sent back with the
+worker's results and merged into the parent with Metrics.merge, so the cpu
+time of worker processes shows up under the parent stage that started them
+'''
+
+import os
+import sys
+import json
+import time
+import datetime
+import resource
+import contextvars
+from contextlib import contextmanager
+
+# set per request (per asyncio task) so stages know which request they belong to
+current_request = contextvars.ContextVar('current_request', default=None)
+
+# cpu seconds reported by worker processes, one counter per stage open in this context
+_child_cpu = contextvars.ContextVar('_child_cpu', default=())
+
+
+def peak_rss():
+    '''Peak resident set size of this process in bytes'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def current_rss():
+    '''Resident set size of this process in bytes now, the peak where /proc is not available'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def children_cpu():
+    '''cpu seconds of the child processes of this process that have been waited for'''
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Metrics:
+    '''Collects one record per stage run'''
+
+    def __init__(self):
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, **fields):
+        '''
+        Time the body of a with block as stage name
+
+        Yields the record dict so the body can fill in fields such as bytes
+        or pixels once it knows them. cpu_seconds is this process only,
+        child_cpu_seconds the worker processes the stage ran, and rss_bytes
+        and rss_delta_bytes the resident set size at the end of the stage and
+        its change over the stage.
+        '''
+        record = {'stage': name, 'request': current_request.get()}
+        record.update(fields)
+        if _child_cpu.get():
+            record['nested'] = True
+        reported = [0.0]
+        token = _child_cpu.set(_child_cpu.get() + (reported,))
+        rss = current_rss()
+        children = children_cpu()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        except BaseException as e:
+            record['error'] = type(e).__name__
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            # workers started by fork are also counted once waited for, forkserver workers only by what they report
+            record['child_cpu_seconds'] = max(reported[0], children_cpu() - children)
+            record['rss_bytes'] = current_rss()
+            record['rss_delta_bytes'] = record['rss_bytes'] - rss
+            record['time'] = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds')
+            _child_cpu.reset(token)
+            self.records.append(record)
+
+    def start_worker(self):
+        '''Forget the records and open stages a worker process inherited from its parent by fork'''
+        self.clear()
+        _child_cpu.set(())
+
+    def drain(self):
+        '''Return and forget the records so far, for a worker process to send back with its results'''
+        records, self.records = self.records, []
+        return records
+
+    def merge(self, records):
+        '''
+        Add records drained in a worker process, tagged with the current
+        request, the cpu time of the outermost ones counts as child cpu of
+        every open stage
+        '''
+        request = current_request.get()
+        for r in records:
+            if r.get('request') is None:
+                r['request'] = request
+            r['worker'] = True
+            self.records.append(r)
+            if r.get('nested'):
+                continue
+            for reported in _child_cpu.get():
+                reported[0] += r.get('cpu_seconds') or 0.0
+
+    def clear(self):
+        self.records = []
+
+    def json_lines(self):
+        return ''.join(json.dumps(r, default=str) + '\n' for r in self.records)
+
+    def prometheus(self, prefix='pyadde'):
+        '''Totals per stage in the Prometheus text exposition format'''
+        totals = {}
+        for r in self.records:
+            t = totals.setdefault(r['stage'], {'count': 0, 'seconds': 0.0, 'cpu_seconds': 0.0, 'child_cpu_seconds': 0.0,
+                                               'bytes': 0, 'pixels': 0})
+            t['count'] += 1
+            for k in ('seconds', 'cpu_seconds', 'child_cpu_seconds', 'bytes', 'pixels'):
+                t[k] += r.get(k) or 0
+
+        lines = []
+        for metric, help_text in (('count', 'number of times the stage ran'),
+                                  ('seconds', 'wall time spent in the stage'),
+                                  ('cpu_seconds', 'cpu time spent in the stage'),
+                                  ('child_cpu_seconds', 'cpu time of worker processes started by the stage'),
+                                  ('bytes', 'bytes transferred or written by the stage'),
+                                  ('pixels', 'pixels processed by the stage')):
+            name = f'{prefix}_stage_{metric}_total'
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for stage, t in sorted(totals.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {t[metric]}')
+        lines.append(f'# HELP {prefix}_peak_rss_bytes peak resident set size of the process')
+        lines.append(f'# TYPE {prefix}_peak_rss_bytes gauge')
+        lines.append(f'{prefix}_peak_rss_bytes {peak_rss()}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filename):
+        '''Write JSON lines, or Prometheus text if filename ends in .prom'''
+        with open(filename, 'w') as f:
+            f.write(self.prometheus() if filename.endswith('.prom') else self.json_lines())
+
+
+# metrics shared by every module
+metrics = Metrics()
@@ -0,0 +1,190 @@
+'''
+Memory-mapped McIDAS AREA files
+Parses the directory of a local AREA file and exposes the nav block and the
+image data as zero-copy numpy views of the mapped file, so navigation and
+write_netcdf.write read straight from disk instead of from a bytes copy
+
+MappedAreaFile has the directory, nav and data attributes of pyarea's
+AreaFile, with data shaped (bands, lines, elements). The directory is
+decoded from the 64 word layout in write_netcdf's HEADER_FIELDS.
+'''
+
+import datetime
+import numpy as np
+
+DIRECTORY_WORDS = 64
+COMMENT_SIZE = 80
+
+# byte offsets into the directory of the character fields, everything else is a 4 byte int
+CHAR_FIELDS = {'memo': (96, 128), 'source_type': (204, 208), 'cal_type': (208, 212),
+               'original_source_type': (224, 228), 'units': (228, 232)}
+
+# 0 based directory word of each int field
+INT_FIELDS = {
+    'relative_position_within_dataset': 0, 'image_type': 1, 'sensor_source_number': 2, 'yyyddd': 3,
+    'hhmmss': 4, 'line_ul': 5, 'element_ul': 6, 'lines': 8, 'elements': 9, 'bytes_per_element': 10,
+    'line_res': 11, 'element_res': 12, 'spectral_band_count': 13, 'line_prefix_length': 14, 'project': 15,
+    'file_yyyddd': 16, 'file_hhmmss': 17, 'spectral_band_map_1_32': 18, 'spectral_band_map_33_64': 19,
+    'data_block_offset': 33, 'nav_block_offset': 34, 'validity_code': 35, 'image_yyyddd': 45,
+    'image_hhmmss_or_ms': 46, 'start_scan': 47, 'prefix_doc_length': 48, 'prefix_cal_length': 49,
+    'prefix_band_length': 50, 'scaling': 58, 'aux_block_offset': 59, 'aux_block_length': 60,
+    'cal_block_offset': 62, 'comment_count': 63,
+}
+
+# data types of 1, 2 and 4 byte elements
+ELEMENT_TYPES = {1: 'u1', 2: 'i2', 4: 'i4'}
+
+
+# McIDAS sensor source numbers, directory word 3
+SENSORS = {
+    0: 'Non-Image Derived Data', 1: 'Test pattern', 2: 'Graphics', 3: 'Miscellaneous',
+    4: 'PDUS Meteosat Visible', 5: 'PDUS Meteosat Infrared', 6: 'PDUS Meteosat Water Vapor', 7: 'Radar',
+    8: 'Miscellaneous Aircraft Data', 9: 'Raw Meteosat', 10: 'Composite image', 11: 'Topography image',
+    12: 'GMS Visible', 13: 'GMS Infrared', 14: 'ATS 6 Visible', 15: 'ATS 6 Infrared',
+    16: 'SMS-1 Visible', 17: 'SMS-1 Infrared', 18: 'SMS-2 Visible', 19: 'SMS-2 Infrared',
+    20: 'GOES-1 Visible', 21: 'GOES-1 Infrared', 22: 'GOES-2 Visible', 23: 'GOES-2 Infrared',
+    24: 'GOES-3 Visible', 25: 'GOES-3 Infrared', 26: 'GOES-4 Visible (VAS)',
+    27: 'GOES-4 Infrared and Water Vapor (VAS)', 28: 'GOES-5 Visible (VAS)',
+    29: 'GOES-5 Infrared and Water Vapor (VAS)', 30: 'GOES-6 Visible', 31: 'GOES-6 Infrared',
+    32: 'GOES-7 Visible, Block 1 Auxiliary Data', 33: 'GOES-7 Infrared',
+    41: 'TIROS-N (POES)', 42: 'NOAA-6', 43: 'NOAA-7', 44: 'NOAA-8', 45: 'NOAA-9', 46: 'Venus',
+    47: 'Voyager 1', 48: 'Voyager 2', 49: 'Galileo', 50: 'Hubble Space Telescope',
+    51: 'MSG-1', 52: 'MSG-2', 53: 'MSG-3', 54: 'Meteosat-3', 55: 'Meteosat-4', 56: 'Meteosat-5',
+    57: 'Meteosat-6', 58: 'Meteosat-7', 60: 'NOAA-10', 61: 'NOAA-11', 62: 'NOAA-12', 63: 'NOAA-13',
+    64: 'NOAA-14', 70: 'GOES-8 Imager', 71: 'GOES-8 Sounder', 72: 'GOES-9 Imager', 73: 'GOES-9 Sounder',
+    74: 'GOES-10 Imager', 75: 'GOES-10 Sounder', 76: 'GOES-11 Imager', 77: 'GOES-11 Sounder',
+    78: 'GOES-12 Imager', 79: 'GOES-12 Sounder', 180: 'GOES-13 Imager', 181: 'GOES-13 Sounder',
+    182: 'GOES-14 Imager', 183: 'GOES-14 Sounder', 184: 'GOES-15 Imager', 185: 'GOES-15 Sounder',
+}
+
+
+class SensorNames(dict):
+    '''Sensor source number to name, numbers without a name come back as "sensor source <n>"'''
+
+    def __missing__(self, key):
+        return f'sensor source {key}'
+
+
+class MappedAreaDirectory:
+    '''AREA directory decoded from the first 256 bytes of the file'''
+
+    def __init__(self, header, byteorder):
+        words = header[:DIRECTORY_WORDS * 4].view(f'{byteorder}i4')
+        for name, word in INT_FIELDS.items():
+            setattr(self, name, int(words[word]))
+        for name, (start, end) in CHAR_FIELDS.items():
+            setattr(self, name, header[start:end].tobytes().strip(b' \x00'))
+        self.sensors = SensorNames(SENSORS)
+        self.comment_cards = []
+
+    @property
+    def bands(self):
+        '''Band numbers present, from the two band maps'''
+        bands = [b + 1 for b in range(32) if self.spectral_band_map_1_32 >> b & 1]
+        return bands + [b + 33 for b in range(32) if self.spectral_band_map_33_64 >> b & 1]
+
+    @property
+    def line_bytes(self):
+        '''Bytes per image line, prefix included'''
+        return self.line_prefix_length + self.elements * self.bytes_per_element * self.spectral_band_count
+
+    @property
+    def nominal_time(self):
+        '''Nominal image time as a naive UTC datetime'''
+        year = self.yyyddd // 1000
+        year += 1900 if year < 1900 else 0
+        day = datetime.datetime(year, 1, 1) + datetime.timedelta(days=self.yyyddd % 1000 - 1)
+        hh, mm, ss = self.hhmmss // 10000, self.hhmmss // 100 % 100, self.hhmmss % 100
+        return day.replace(hour=hh, minute=mm, second=ss)
+
+
+def read_directory(header):
+    '''(MappedAreaDirectory, byte order) of the first 256 bytes of an AREA file, a uint8 array'''
+    # word 2 is always 4, pick the byte order that reads it so
+    byteorder = '>' if int(header[4:8].view('>i4')[0]) == 4 else '<'
+    if int(header[4:8].view(f'{byteorder}i4')[0]) != 4:
+        raise ValueError('Not an AREA file, directory word 2 is not 4')
+    adir = MappedAreaDirectory(header, byteorder)
+    if adir.bytes_per_element not in ELEMENT_TYPES:
+        raise ValueError(f'Unsupported bytes_per_element {adir.bytes_per_element}')
+    return adir, byteorder
+
+
+def is_area(filename):
+    '''True if filename starts like an AREA file, directory word 2 is 4 in either byte order'''
+    with open(filename, 'rb') as f:
+        word = f.read(8)[4:]
+    return word in (b'\x00\x00\x00\x04', b'\x04\x00\x00\x00')
+
+
+def nav_block(raw, adir, byteorder):
+    '''Nav block words of the AREA bytes raw, up to the next block or the end of raw'''
+    start = adir.nav_block_offset
+    if start <= 0:
+        return np.zeros(0, dtype=f'{byteorder}i4')
+    following = [o for o in (adir.cal_block_offset, adir.aux_block_offset, adir.data_block_offset) if o > start]
+    end = min(min(following) if following else raw.size, raw.size)
+    return raw[start:start + (end - start) // 4 * 4].view(f'{byteorder}i4')
+
+
+def data_view(buffer, adir, byteorder, lines=None, offset=None):
+    '''
+    (bands, lines, elements) view of the data in buffer, skipping each line
+    prefix, bands interleaved by pixel. buffer holds the whole file by default,
+    or lines lines starting at byte offset
+    '''
+    size = adir.bytes_per_element
+    dtype = np.dtype(ELEMENT_TYPES[size]).newbyteorder(byteorder)
+    return np.ndarray(shape=(adir.spectral_band_count, adir.lines if lines is None else lines, adir.elements),
+                      dtype=dtype, buffer=buffer,
+                      offset=(adir.data_block_offset if offset is None else offset) + adir.line_prefix_length,
+                      strides=(size, adir.line_bytes, size * adir.spectral_band_count))
+
+
+def comment_cards(comments):
+    '''80 character comment cards of the uint8 array comments, a partial last card is dropped'''
+    return [comments[i:i + COMMENT_SIZE].tobytes().decode('ascii', errors='replace')
+            for i in range(0, comments.size - COMMENT_SIZE + 1, COMMENT_SIZE)]
+
+
+class MappedAreaFile:
+    '''
+    AREA file backed by a memory map
+
+    source is a file name or anything numpy can view as bytes, e.g. a
+    numpy.memmap of a cached file. Nothing is copied: nav and data are views
+    into source, so source must stay open (and unchanged) while they are used.
+    '''
+
+    def __init__(self, source):
+        if isinstance(source, str) or hasattr(source, '__fspath__'):
+            self.filename = source
+            raw = np.memmap(source, dtype=np.uint8, mode='r')
+        else:
+            self.filename = None
+            raw = source.view(np.uint8) if isinstance(source, np.ndarray) else np.frombuffer(source, dtype=np.uint8)
+        if raw.size < DIRECTORY_WORDS * 4:
+            raise ValueError(f'Not an AREA file, {raw.size} bytes is shorter than the directory')
+        self.raw = raw
+
+        adir, self.byteorder = read_directory(raw[:DIRECTORY_WORDS * 4])
+        self.directory = adir
+        data_end = adir.data_block_offset + adir.lines * adir.line_bytes
+        if data_end > raw.size:
+            raise ValueError(f'AREA file is truncated, data ends at byte {data_end} of {raw.size}')
+
+        self.nav = nav_block(raw, adir, self.byteorder)
+        self.data = data_view(raw, adir, self.byteorder)
+        comments = raw[data_end:data_end + adir.comment_count * COMMENT_SIZE]
+        adir.comment_cards = comment_cards(comments)
+
+    def line_prefix(self, line):
+        '''Raw prefix bytes of one image line'''
+        adir = self.directory
+        start = adir.data_block_offset + line * adir.line_bytes
+        return self.raw[start:start + adir.line_prefix_length]
+
+
+def open_area(filename):
+    '''Memory-map the AREA file filename'''
+    return MappedAreaFile(filename)
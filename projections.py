@@ -6,52 +6,199 @@ import matplotlib as mpl
 import cartopy.crs as ccrs
 from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
 import numpy as np
+from collections import OrderedDict
+from filecache import cache_key
+from metrics import metrics
 
 
-def plate_carree(swath_def, data, proj_lat, proj_lon, radius_nn=50000):
+class PlanCache:
+    '''
+    Resampling plans (kd-tree neighbour indices) keyed by swath geometry and target area
+
+    Plans are kept in memory (up to max_plans) and, if cache is a
+    filecache.FileCache, on disk so later runs skip the kd-tree build too
+    '''
+
+    def __init__(self, cache=None, max_plans=4):
+        self.cache = cache
+        self.max_plans = max_plans
+        self.plans = OrderedDict()
+
+    def key(self, swath_def, area_def, radius_nn):
+        swath = (np.asarray(swath_def.lons), np.asarray(swath_def.lats))
+        return cache_key('nn', *swath, area_def.proj_str, area_def.shape, area_def.area_extent, radius_nn)
+
+    def get(self, swath_def, area_def, radius_nn):
+        '''Return (valid_input_index, valid_output_index, index_array), building the plan on a miss'''
+        key = self.key(swath_def, area_def, radius_nn)
+        if key in self.plans:
+            self.plans.move_to_end(key)
+            return self.plans[key]
+
+        hit = self.cache.load(key) if self.cache is not None else None
+        if hit is not None:
+            arrays, _ = hit
+            plan = arrays['valid_input_index'], arrays['valid_output_index'], arrays['index_array']
+        else:
+            valid_input_index, valid_output_index, index_array, _ = kd_tree.get_neighbour_info(
+                swath_def, area_def, radius_nn, neighbours=1, epsilon=0.5)
+            plan = valid_input_index, valid_output_index, index_array
+            if self.cache is not None:
+                self.cache.save(key, {'valid_input_index': valid_input_index,
+                                      'valid_output_index': valid_output_index,
+                                      'index_array': index_array})
+
+        self.plans[key] = plan
+        if len(self.plans) > self.max_plans:
+            self.plans.popitem(last=False)
+        return plan
+
+
+def subset(swath_def, data, bbox=None, margin=0.0):
+    '''
+    Keep only the swath pixels that can land in the target area
+
+    Drops pixels off the earth (NaN lat/lon) and, if bbox (lon_min, lat_min,
+    lon_max, lat_max in degrees, lon_min > lon_max crosses the dateline) is
+    given, pixels more than margin degrees outside it. Returns a 1d
+    SwathDefinition and data, or the inputs unchanged if every pixel is kept.
+    '''
+    lons, lats = np.asarray(swath_def.lons), np.asarray(swath_def.lats)
+    keep = np.isfinite(lons) & np.isfinite(lats)
+    if bbox is not None:
+        lon_min, lat_min, lon_max, lat_max = bbox
+        lon_margin = margin / max(np.cos(np.radians(min(max(abs(lat_min), abs(lat_max)) + margin, 90.0))), 0.01)
+        # longitude east of lon_min - lon_margin, wrapped to 0..360
+        east = (lons - (lon_min - lon_margin)) % 360.0
+        with np.errstate(invalid='ignore'):
+            keep &= (east <= ((lon_max - lon_min) % 360.0 or 360.0) + 2 * lon_margin)
+            keep &= (lats >= lat_min - margin) & (lats <= lat_max + margin)
+    if keep.all():
+        return swath_def, data
+    return geometry.SwathDefinition(lons=lons[keep], lats=lats[keep]), np.asarray(data)[keep]
+
+
+def resample(swath_def, data, area_def, radius_nn=50000, plans=None, bbox=None):
+    '''
+    Nearest neighbour resample, reusing the neighbour search from plans (a PlanCache) if given
+
+    Only pixels on the earth, and inside bbox if given, are resampled, see subset
+    '''
+    swath_def, data = subset(swath_def, data, bbox, margin=np.degrees(radius_nn / 6378137.0))
+    with metrics.stage(f'resample.{area_def.area_id}', pixels=np.size(data), planned=plans is not None):
+        if plans is None:
+            return kd_tree.resample_nearest(swath_def, data, area_def, radius_of_influence=radius_nn, epsilon=0.5)
+
+        valid_input_index, valid_output_index, index_array = plans.get(swath_def, area_def, radius_nn)
+        return kd_tree.get_sample_from_neighbour_info('nn', area_def.shape, data, valid_input_index,
+                                                      valid_output_index, index_array)
+
+
+def sector(swath_def, data, proj_lat, proj_lon, radius_nn=50000, plans=None, bbox=None, width=1200, height=None):
+    '''
+    Regional plate carree grid covering bbox (lon_min, lat_min, lon_max, lat_max in degrees)
+
+    height defaults to whatever makes pixels square at the centre latitude.
+    Only the part of the swath inside bbox is resampled.
+    '''
+    if bbox is None:
+        raise ValueError('sector projection needs a bbox (lon_min, lat_min, lon_max, lat_max)')
+    lon_min, lat_min, lon_max, lat_max = bbox
+    lon_span = (lon_max - lon_min) % 360.0 or 360.0
+    lon_0 = (lon_min + lon_span / 2.0 + 180.0) % 360.0 - 180.0
+    lat_ts = (lat_min + lat_max) / 2.0
+    projection = {'proj': 'eqc', 'ellps': 'WGS84', 'lon_0': lon_0, 'lat_ts': lat_ts}
+    a = 6378137.0
+    x = float(a * np.radians(lon_span / 2.0) * np.cos(np.radians(lat_ts)))
+    extent = [-x, float(a * np.radians(lat_min)), x, float(a * np.radians(lat_max))]
+    height = height or max(1, round(width * (extent[3] - extent[1]) / (2 * x)))
+    area_def = create_area_def('sector', projection=projection, description='Regional Plate Carree Proj', units='meters', width=width, height=height, area_extent=extent)
+
+    res = resample(swath_def, data, area_def, radius_nn, plans, bbox=bbox)
+    crs = area_def.to_cartopy_crs()
+    return res, crs, extent
+
+
+def plate_carree(swath_def, data, proj_lat, proj_lon, radius_nn=50000, plans=None, width=2702, height=None):
+    height = height or width
     projection = {'proj': 'eqc', 'ellps':'WGS84', 'lon_0': proj_lon, 'lat_0': proj_lat}
     extent = [-10018754.17, -10018754.17, 10018754.17, 10018754.17]
-    area_def = create_area_def('pc_world', projection=projection, description='Plate Carree Proj', units='meters', width=2702, height=2702, area_extent=extent)
+    area_def = create_area_def('pc_world', projection=projection, description='Plate Carree Proj', units='meters', width=width, height=height, area_extent=extent)
     
-    res = kd_tree.resample_nearest(swath_def, data, area_def, radius_of_influence=radius_nn, epsilon=0.5)
+    res = resample(swath_def, data, area_def, radius_nn, plans)
     crs = area_def.to_cartopy_crs()
     return res, crs, extent
 
 
-def geostationary(swath_def, data, proj_lat, proj_lon, radius_nn=50000):
+def geostationary(swath_def, data, proj_lat, proj_lon, radius_nn=50000, plans=None, width=2712, height=None):
+    height = height or round(width * 2702 / 2712)
     projection = {'proj': 'geos', 'a': '6378169', 'h': '35785831', 'lon_0': proj_lon, 'lat_0': proj_lat, 'rf': 295.488065897001}
     extent = [-5434201.1352, -5415668.5992, 5434201.1352, 5415668.5992]
-    area_def = create_area_def('geos_full_disk', projection=projection, description='Geostationary Proj', units='meters', width=2712, height=2702, area_extent=extent)
+    area_def = create_area_def('geos_full_disk', projection=projection, description='Geostationary Proj', units='meters', width=width, height=height, area_extent=extent)
 
-    res = kd_tree.resample_nearest(swath_def, data, area_def, radius_of_influence=radius_nn, epsilon=0.5)
+    res = resample(swath_def, data, area_def, radius_nn, plans)
     crs = area_def.to_cartopy_crs()
     return res, crs, extent
 
 
-def robinson(swath_def, data, proj_lat, proj_lon, radius_nn=50000):
+def robinson(swath_def, data, proj_lat, proj_lon, radius_nn=50000, plans=None, width=2702, height=None):
+    height = height or width
     projection = {'proj': 'robin', 'ellps': 'WGS84', 'lon_0': proj_lon, 'lat_0': proj_lat}
     extent = [-20037508.34, -10018754.17, 20037508.34, 10018754.17]
-    area_def = create_area_def('robin_world', projection=projection, description='Robinson Proj', units='meters', width=2702, height=2702, area_extent=extent)
+    area_def = create_area_def('robin_world', projection=projection, description='Robinson Proj', units='meters', width=width, height=height, area_extent=extent)
 
-    res = kd_tree.resample_nearest(swath_def, data, area_def, radius_of_influence=radius_nn, epsilon=0.5)
+    res = resample(swath_def, data, area_def, radius_nn, plans)
     crs = area_def.to_cartopy_crs()
     return res, crs, extent
 
 
-def mollweide(swath_def, data, proj_lat, proj_lon, radius_nn=50000):
+def mollweide(swath_def, data, proj_lat, proj_lon, radius_nn=50000, plans=None, width=1920, height=None):
+    height = height or round(width * 3 / 4)
     projection = {'proj': 'moll', 'ellps': 'WGS84', 'lon_0': proj_lon, 'lat_0': proj_lat}
     extent = [-20037508.34, -10018754.17, 20037508.34, 10018754.17]
-    area_def = create_area_def('mollweide', projection=projection, description='Mollweide projection', units='meters', width=1920, height=1440, area_extent=extent)
-    res = kd_tree.resample_nearest(swath_def, data, area_def, radius_of_influence=radius_nn, epsilon=0.5)
+    area_def = create_area_def('mollweide', projection=projection, description='Mollweide projection', units='meters', width=width, height=height, area_extent=extent)
+    res = resample(swath_def, data, area_def, radius_nn, plans)
     crs = area_def.to_cartopy_crs()
     return res, crs, extent
 
 
-def plot(img_data, crs, extent, figsize=(8,8), cmap='gist_gray', figtitle=''):
+def pyramid(img_data, levels=4, method='mean', fill_value=0):
+    '''
+    Zoom levels of one resampled image, full size first, each level half the size of the one before
+
+    method 'mean' averages 2x2 blocks ignoring fill_value pixels, 'nearest'
+    keeps every other pixel. Lets a single resampling pass feed every zoom level.
+    '''
+    img_data = np.ma.filled(img_data, fill_value)
+    levels_out = [img_data]
+    for _ in range(1, levels):
+        img = levels_out[-1]
+        if min(img.shape[:2]) < 2:
+            break
+        if method == 'nearest':
+            levels_out.append(img[::2, ::2])
+            continue
+        h, w = img.shape[:2]
+        img = np.pad(img, ((0, h % 2), (0, w % 2)) + ((0, 0),) * (img.ndim - 2), constant_values=fill_value)
+        blocks = img.reshape(img.shape[0] // 2, 2, img.shape[1] // 2, 2, *img.shape[2:])
+        valid = blocks != fill_value
+        total = np.where(valid, blocks, 0).sum(axis=(1, 3), dtype=np.float64)
+        count = valid.sum(axis=(1, 3))
+        mean = np.divide(total, count, out=np.full(total.shape, float(fill_value)), where=count > 0)
+        if np.issubdtype(img.dtype, np.integer):
+            mean = np.rint(mean)
+        levels_out.append(mean.astype(img.dtype))
+    return levels_out
+
+
+def plot(img_data, crs, extent, figsize=(8,8), cmap='gist_gray', figtitle='', regional=False):
     fig = plt.figure(figsize=figsize)
     ax = plt.axes(projection=crs) 
     ax.set_title(figtitle)
-    ax.set_global()
+    if regional:
+        ax.set_extent(crs.bounds, crs=crs)
+    else:
+        ax.set_global()
     
     cmap = mpl.colormaps[cmap]
     cmap.set_under(color='white')
@@ -0,0 +1,123 @@
+'''
+Headless rendering of projections to PNG files
+Every requested projection of one image is drawn in its own worker process
+from a single navigation result. Workers keep the SwathDefinition of the last
+nav block they drew, so a pool shared by a batch of images with the same
+navigation builds it once per worker
+'''
+
+import os
+import matplotlib
+from concurrent.futures import ProcessPoolExecutor
+from metrics import metrics
+from write_netcdf import pool_context, nav_cache_key
+
+PROJECTIONS = {'G': 'Geostationary', 'P': 'Plate Carree', 'R': 'Robinson', 'M': 'Mollweide', 'S': 'Sector'}
+
+_worker = {}
+
+
+def image_name(adir, band=0):
+    '''File name stem for an image, ccyyddd_hhmmss_b<band>'''
+    yyyddd = adir.yyyddd
+    year = ((yyyddd // 1000) % 1900) + 1900
+    return f'{year}{yyyddd % 1000:03}_{adir.hhmmss:06}_b{adir.bands[band]}'
+
+
+def _init_worker(plan_dir):
+    '''Set up the backend and resampling plan cache once per worker process'''
+    matplotlib.use('Agg')
+    metrics.start_worker()
+    import projections
+    from filecache import FileCache
+
+    _worker['plans'] = projections.PlanCache(cache=FileCache(plan_dir) if plan_dir else None)
+
+
+def _swath(key, lat, lon):
+    '''SwathDefinition of lat/lon, rebuilt only when the nav key changes'''
+    if _worker.get('swath_key') != key:
+        from pyresample import geometry
+        _worker['swath_def'] = geometry.SwathDefinition(lons=lon, lats=lat)
+        _worker['swath_key'] = key
+    return _worker['swath_def']
+
+
+def _render(image, code, filename, figsize, cmap, bbox, width, levels):
+    '''Render one projection in a worker, returns its files and the metrics records of the worker'''
+    key, lat, lon, *args = image
+    with metrics.stage(f'render.{code}'):
+        filenames = _draw(_swath(key, lat, lon), args, code, filename, figsize, cmap, bbox, width, levels)
+    return filenames, metrics.drain()
+
+
+def _draw(swath_def, args, code, filename, figsize, cmap, bbox, width, levels):
+    from matplotlib import pyplot as plt
+    import projections
+
+    kwargs = {'plans': _worker['plans']}
+    if code == 'S':
+        kwargs['bbox'] = bbox
+    if width:
+        kwargs['width'] = width
+    project = {'G': projections.geostationary, 'P': projections.plate_carree,
+               'R': projections.robinson, 'M': projections.mollweide, 'S': projections.sector}[code]
+    data, crs, extent = project(swath_def, *args, **kwargs)
+    ax = projections.plot(data, crs, extent, figsize=figsize, cmap=cmap, figtitle=f'{PROJECTIONS[code]} Projection',
+                          regional=code == 'S')
+    ax.figure.savefig(filename)
+    plt.close(ax.figure)
+    filenames = [filename]
+
+    # zoom levels of the bare image, all from the one resampling pass above
+    if levels and levels > 1:
+        stem = filename[:-len('.png')]
+        for z, img in enumerate(projections.pyramid(data, levels)):
+            filenames.append(f'{stem}_z{z}.png')
+            plt.imsave(filenames[-1], img, cmap=cmap)
+    return filenames
+
+
+def render_pool(workers, plan_dir=None):
+    '''Process pool of workers rendering processes, to share between calls to render_projections'''
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(plan_dir,),
+                               mp_context=pool_context())
+
+
+def render_projections(area, lat, lon, proj_lat, proj_lon, radius, codes='GPRM', outdir='.', band=0,
+                       workers=None, plan_dir=None, figsize=(8, 8), cmap='gist_gray', bbox=None, width=None, levels=None,
+                       pool=None):
+    '''
+    Render projections (any of G, P, R, M, S) of one band of area to PNG files in outdir
+
+    lat/lon come from nav_transform, workers defaults to one process per
+    projection. plan_dir is an optional directory of cached resampling plans.
+    The S(ector) projection covers bbox (lon_min, lat_min, lon_max, lat_max).
+    width overrides the width of every target grid, levels > 1 also saves
+    that many zoom levels of each bare image as <name>_z<level>.png.
+    pool is a render_pool to use instead of starting one, workers and
+    plan_dir are then those of the pool. Returns the list of files written.
+    '''
+    codes = [c.upper() for c in codes if c.upper() in PROJECTIONS and (c.upper() != 'S' or bbox is not None)]
+    if not codes:
+        return []
+    os.makedirs(outdir, exist_ok=True)
+    stem = os.path.join(outdir, image_name(area.directory, band))
+    filenames = [f'{stem}_{PROJECTIONS[c].replace(" ", "_").lower()}.png' for c in codes]
+
+    owned = pool is None
+    if owned:
+        pool = render_pool(workers or len(codes), plan_dir)
+    try:
+        n = len(codes)
+        image = (nav_cache_key(area), lat, lon, area.data[band], proj_lat, proj_lon, radius)
+        results = pool.map(_render, [image] * n, codes, filenames, [figsize] * n, [cmap] * n, [bbox] * n,
+                           [width] * n, [levels] * n)
+        written = []
+        for files, records in results:
+            metrics.merge(records)
+            written.extend(files)
+        return written
+    finally:
+        if owned:
+            pool.shutdown()
@@ -0,0 +1,63 @@
+'''
+Pixel spacing of navigated images
+Great circle distances and the nearest neighbour radius of influence used to
+resample an image, with no dependencies beyond numpy so benchmark.py can time
+them without the ADDE client or the projection libraries installed
+'''
+
+import numpy as np
+from metrics import metrics
+
+# write_netcdf.MISSING_VALUE, kept here so this module does not need netCDF4
+MISSING_VALUE = 0x7FC00000
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    '''Great circle distance in km, works elementwise on numpy arrays'''
+    R = 6371
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+
+    x1 = lat2 - lat1
+    y1 = lon2 - lon1
+
+    a = np.sin(x1 / 2)**2 + np.cos(lat2) * np.cos(lat1) * np.sin(y1 / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+    return R * c
+
+
+def nn_radius(lat, lon, default=50000):
+    '''
+    Radius of influence in meters for resample_nearest
+
+    Median great circle spacing between valid neighbours along the middle row
+    and the middle column, the larger of the two so neither direction leaves holes.
+    lat/lon may be the lat/lon of a goesnav.LazyNav, then only the tiles along
+    that row and column are navigated
+    '''
+    if not hasattr(lat, 'shape'):
+        lat, lon = np.asarray(lat), np.asarray(lon)
+    with metrics.stage('nn_radius'):
+        return _nn_radius(lat, lon, default)
+
+
+def _nn_radius(lat, lon, default):
+    mid_line = lat.shape[0] // 2
+    mid_elem = lat.shape[1] // 2
+
+    def valid(v):
+        # off the earth is NaN, or the MISSING_VALUE integer sentinel from older callers
+        v = np.asarray(v, dtype=np.float64)
+        return np.where(v == MISSING_VALUE, np.nan, v)
+
+    row_lat, row_lon = valid(lat[mid_line]), valid(lon[mid_line])
+    col_lat, col_lon = valid(lat[:, mid_elem]), valid(lon[:, mid_elem])
+    row = haversine(row_lat[:-1], row_lon[:-1], row_lat[1:], row_lon[1:])
+    col = haversine(col_lat[:-1], col_lon[:-1], col_lat[1:], col_lon[1:])
+
+    spacing = [np.median(d[np.isfinite(d)]) for d in (row, col) if np.isfinite(d).any()]
+    if not spacing:
+        return default
+    return float(max(spacing)) * 1000
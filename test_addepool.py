@@ -0,0 +1,123 @@
+'''
+AddePool against a stand-in ADDE client, no network or pyadde needed
+'''
+
+import asyncio
+import unittest
+from addepool import AddePool
+
+
+class StandInClient:
+    '''Async context manager with an aget like AddeClient's, fails when asked to'''
+
+    opened = []
+
+    def __init__(self, host=None, project=0, user='XXXX'):
+        self.host = host
+        self.closed = False
+        StandInClient.opened.append(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed = True
+
+    async def aget(self, fail=False, delay=0.0, **kwargs):
+        StandInServer.in_flight += 1
+        StandInServer.max_in_flight = max(StandInServer.max_in_flight, StandInServer.in_flight)
+        try:
+            await asyncio.sleep(delay)
+            if fail:
+                raise ConnectionError('stand-in failure')
+            return {'host': self.host, 'client': id(self), **kwargs}
+        finally:
+            StandInServer.in_flight -= 1
+
+
+class StandInServer:
+    '''Requests in flight across every stand-in client'''
+    in_flight = 0
+    max_in_flight = 0
+
+
+class AddePoolTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        StandInClient.opened = []
+        StandInServer.in_flight = StandInServer.max_in_flight = 0
+
+    def pool(self, **kwargs):
+        return AddePool(client_factory=StandInClient, **kwargs)
+
+    async def test_reuses_idle_session(self):
+        async with self.pool() as pool:
+            first = await pool.aget('host', band=1)
+            second = await pool.aget('host', band=2)
+        self.assertEqual(first['client'], second['client'])
+        self.assertEqual(pool.stats['opened'], 1)
+        self.assertEqual(pool.stats['reused'], 1)
+
+    async def test_sessions_are_per_host(self):
+        async with self.pool() as pool:
+            a = await pool.aget('a')
+            b = await pool.aget('b')
+        self.assertNotEqual(a['client'], b['client'])
+        self.assertEqual(pool.stats['opened'], 2)
+
+    async def test_failed_session_is_closed_not_reused(self):
+        async with self.pool() as pool:
+            with self.assertRaises(ConnectionError):
+                await pool.aget('host', fail=True)
+            await pool.aget('host')
+        failed, replacement = StandInClient.opened
+        self.assertTrue(failed.closed)
+        self.assertIsNot(failed, replacement)
+        self.assertEqual(pool.stats['discarded'], 2)  # the failed session, then the replacement on close
+
+    async def test_unhealthy_session_is_replaced(self):
+        async def check(client):
+            return False
+
+        async with self.pool(check=check) as pool:
+            await pool.aget('host')
+            await pool.aget('host')
+        self.assertEqual(pool.stats['opened'], 2)
+        self.assertEqual(pool.stats['reused'], 0)
+        self.assertTrue(StandInClient.opened[0].closed)
+
+    async def test_check_that_raises_counts_as_unhealthy(self):
+        async def check(client):
+            raise ConnectionError('stand-in check failure')
+
+        async with self.pool(check=check) as pool:
+            await pool.aget('host')
+            await pool.aget('host')
+        self.assertEqual(pool.stats['opened'], 2)
+
+    async def test_idle_session_expires(self):
+        async with self.pool(max_idle=0.01) as pool:
+            await pool.aget('host')
+            await asyncio.sleep(0.05)
+            await pool.aget('host')
+        self.assertEqual(pool.stats['opened'], 2)
+        self.assertTrue(StandInClient.opened[0].closed)
+
+    async def test_size_limits_sessions_and_requests_in_flight(self):
+        async with self.pool(size=2) as pool:
+            await asyncio.gather(*(pool.aget('host', delay=0.01) for _ in range(8)))
+        self.assertEqual(StandInServer.max_in_flight, 2)
+        self.assertEqual(pool.stats['opened'], 2)
+        self.assertEqual(pool.stats['reused'], 6)
+
+    async def test_close_closes_idle_sessions_and_refuses_requests(self):
+        pool = self.pool()
+        await pool.aget('host')
+        await pool.close()
+        self.assertTrue(StandInClient.opened[0].closed)
+        with self.assertRaises(RuntimeError):
+            await pool.aget('host')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,13 +2,31 @@
 Converted to python from c
 based on mcidas file ncdfaput.c
 Converts AREAnnn file to netCDF4 file
-Only works for Area files with 1 band
+Single band files are written CF compliant, multi-band files share one
+lat/lon grid and are written band by band
+append adds single band images of the same geometry to one CF time cube
+with an unlimited time dimension and a single lat/lon grid
 '''
 
 import netCDF4 as nc
 import datetime
 import numpy as np
+import os
 import math
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from goesnav import GoesNav, area_grid
+from filecache import cache_key
+from metrics import metrics
+
+# the netCDF4/HDF5 library is not thread-safe, every file is written under this one lock
+netcdf_lock = threading.Lock()
+
+# mcidas missing value for off the earth pixels, the bit pattern of a float32 NaN
+MISSING_VALUE = 0x7FC00000
+MISSING_FLOAT = np.array(MISSING_VALUE, dtype=np.uint32).view(np.float32)[()]
 
 '''
 HEADER_FIELDS = (
@@ -78,12 +96,116 @@ HEADER_FIELDS = (
 '''
 
 
-def write(area_file, latdata, londata, filename='NCDFxxxx.nc', audit_str=''):
-    '''Write netCDF file from AreaFile'''
+# integer packing for lat/lon, (dtype, scale_factor, add_offset), about 0.003 and 0.006 degrees
+LATLON_PACKING = {'lat': ('i2', 90.0 / 32000, 0.0), 'lon': ('i2', 180.0 / 32000, 0.0)}
+
+
+def line_blocks(source, num_lines, block_lines):
+    '''Yield (start line, block) from a 2-D array or from an iterator of row-chunks'''
+    if hasattr(source, 'shape') or isinstance(source, (list, tuple)):
+        for start in range(0, num_lines, block_lines):
+            yield start, source[start:start + block_lines]
+    else:
+        start = 0
+        for block in source:
+            yield start, block
+            start += len(block)
+
+
+def create_packed(f, name, dimensions, pack, fill_value, **kwargs):
+    '''createVariable, stored as f4 or packed into the integer type given by pack[name]'''
+    if pack and name in pack:
+        dtype, scale_factor, add_offset = pack[name]
+        var = f.createVariable(name, dtype, dimensions=dimensions, fill_value=np.iinfo(dtype).min, **kwargs)
+        var.scale_factor = scale_factor
+        var.add_offset = add_offset
+        return var
+    return f.createVariable(name, 'f4', dimensions=dimensions, fill_value=fill_value, **kwargs)
+
+
+def audit_cards(adir, audit_str):
+    '''(cards, 80) S1 array of the AREA comment cards followed by audit_str split into 80 character cards'''
+    num_chunks = 1
+    if len(audit_str) > 0:
+        num_chunks = math.ceil(len(audit_str) / 80)
+    audit_chunks = [audit_str[i:i+80] for i in range(0, num_chunks * 80, 80)]
+    if adir.comment_cards:
+        audit_chunks = adir.comment_cards + audit_chunks
+    return np.array(audit_chunks, 'S80').view('S1').reshape(-1, 80)
+
+
+def write_grid(var, source, num_lines, block_lines, pack):
+    '''Write a lat or lon grid block_lines lines at a time, NaN is masked when the variable is packed'''
+    for start, block in line_blocks(source, num_lines, block_lines):
+        block = np.asarray(block, dtype=np.float32)
+        if pack and var.name in pack:
+            off_earth = np.isnan(block)
+            block = np.ma.masked_array(np.where(off_earth, 0, block), mask=off_earth)
+        var[start:start + len(block)] = block
+
+
+def data_attributes(data, adir):
+    '''long_name, type and units of the data variable from the directory cal type'''
+    cal_type = adir.cal_type
+    match cal_type:
+        case b'RAD' | 'RAD':
+            data.long_name = 'Radiance'
+        case b'BRIT' |'BRIT':
+            data.long_name = '0-255 Brightness Temperature'
+        case b'TEMP' | 'TEMP':
+            data.long_name = 'Temperature' 
+        case b'ALB' | 'ALB':
+            data.long_name = 'Albedo'
+        case b'RAW' | 'RAW':
+            data.long_name = 'Raw Satellite Counts'
+        case _:
+            data.long_name = 'data'
+
+    data.type = adir.source_type.decode() # decode bytes into utf-8 encoded string
+
+    # lines 806 to line 841: units for RAD cal type
+    # not sure if this works
+    if cal_type == 'RAD' or cal_type == b'RAD':
+        cal_unit = adir.units  # should be a byte string
+        if isinstance(cal_type, bytes):
+            cal_unit = cal_unit.decode(encoding='utf-8')
+        if isinstance(cal_type, str):
+            if cal_unit.startswith('wP') or cal_unit.startswith('Wp') or cal_unit.startswith('wp') or cal_unit.startswith('WP'):
+                data.units = 'Watts/meter2/steradian'
+            elif cal_unit.startswith('mP') or cal_unit.startswith('Mp') or cal_unit.startswith('mp') or cal_unit.startswith('MP'):
+                data.units = 'Milliwatts/meter2/steradian/(cm-1)'
+            elif cal_unit.startswith('wM') or cal_unit.startswith('Wm') or cal_unit.startswith('wm') or cal_unit.startswith('WM'):
+                data.units = 'Watts/meter2/steradian/micron'
+            else:
+                data.units = 'Unknown'
+        else:
+            data.units = 'Unknown'
+    elif cal_type == 'TEMP' or cal_type == b'TEMP':
+        data.units = 'K'
+    elif cal_type == 'ALB' or cal_type == b'ALB':
+        data.units = 'percent'
+
+
+def write(area_file, latdata, londata, filename='NCDFxxxx.nc', audit_str='', block_lines=512,
+          zlib=False, complevel=4, shuffle=False, chunks=None, pack=None):
+    '''
+    Write netCDF file from AreaFile
+
+    latdata/londata are 2-D arrays or iterators of row-chunks, everything is
+    written block_lines lines at a time. zlib, complevel and shuffle turn on
+    compression, chunks is the (lines, elems) HDF5 chunk shape. pack maps
+    'data', 'lat' and 'lon' to (dtype, scale_factor, add_offset) to store
+    them as packed integers, pack=True uses LATLON_PACKING
+    '''
+
+    if pack is True:
+        pack = LATLON_PACKING
+    storage = {'zlib': zlib, 'complevel': complevel, 'shuffle': shuffle}
 
     CFstatus = True
     adir = area_file.directory
-    with nc.Dataset(filename, 'w', format='NETCDF4') as f:
+    pixels = adir.lines * adir.elements * adir.spectral_band_count
+    with netcdf_lock, metrics.stage('write', pixels=pixels), nc.Dataset(filename, 'w', format='NETCDF4') as f:
 
         if adir.spectral_band_count > 1:
             CFstatus = False
@@ -99,11 +221,7 @@ def write(area_file, latdata, londata, filename='NCDFxxxx.nc', audit_str=''):
             f.createDimension('bands', adir.spectral_band_count)
 
 
-        num_chunks = 1
-        if len(audit_str) > 0:
-            num_chunks = math.ceil(len(audit_str) / 80)
-
-        f.createDimension('auditCount', adir.comment_count + num_chunks)
+        f.createDimension('auditCount', len(audit_cards(adir, audit_str)))
         f.createDimension('auditSize', 80) # length of single comment card
 
         # define variables
@@ -168,68 +286,32 @@ def write(area_file, latdata, londata, filename='NCDFxxxx.nc', audit_str=''):
         audittrail.long_name = 'audit trail'
 
         if CFstatus:
-            data = f.createVariable('data', 'f4', dimensions=('time', 'yc', 'xc'))
+            data = create_packed(f, 'data', ('time', 'yc', 'xc'), pack, None,
+                                 chunksizes=(1,) + tuple(chunks) if chunks else None, **storage)
         else:
-            data = f.createVariable('data', 'f4', dimensions=('bands', 'lines', 'elems'))
-
-        cal_type = adir.cal_type
-        match cal_type:
-            case b'RAD' | 'RAD':
-                data.long_name = 'Radiance'
-            case b'BRIT' |'BRIT':
-                data.long_name = '0-255 Brightness Temperature'
-            case b'TEMP' | 'TEMP':
-                data.long_name = 'Temperature' 
-            case b'ALB' | 'ALB':
-                data.long_name = 'Albedo'
-            case b'RAW' | 'RAW':
-                data.long_name = 'Raw Satellite Counts'
-            case _:
-                data.long_name = 'data'
-        
-        data.type = adir.source_type.decode() # decode bytes into utf-8 encoded string
-        
+            data = create_packed(f, 'data', ('bands', 'lines', 'elems'), pack, None,
+                                 chunksizes=(1,) + tuple(chunks) if chunks else None, **storage)
+
+        data_attributes(data, adir)
         if CFstatus:
             data.coordinates = 'lon lat'
 
-        # lines 806 to line 841: units for RAD cal type
-        # not sure if this works
-        if cal_type == 'RAD' or cal_type == b'RAD':
-            cal_unit = adir.units  # should be a byte string
-            if isinstance(cal_type, bytes):
-                cal_unit = cal_unit.decode(encoding='utf-8')
-            if isinstance(cal_type, str):
-                if cal_unit.startswith('wP') or cal_unit.startswith('Wp') or cal_unit.startswith('wp') or cal_unit.startswith('WP'):
-                    data.units = 'Watts/meter2/steradian'
-                elif cal_unit.startswith('mP') or cal_unit.startswith('Mp') or cal_unit.startswith('mp') or cal_unit.startswith('MP'):
-                    data.units = 'Milliwatts/meter2/steradian/(cm-1)'
-                elif cal_unit.startswith('wM') or cal_unit.startswith('Wm') or cal_unit.startswith('wm') or cal_unit.startswith('WM'):
-                    data.units = 'Watts/meter2/steradian/micron'
-                else:
-                    data.units = 'Unknown'
-            else:
-                data.units = 'Unknown'
-        elif cal_type == 'TEMP' or cal_type == b'TEMP':
-            data.units = 'K'
-        elif cal_type == 'ALB' or cal_type == b'ALB':
-            data.units = 'percent'
-
         if CFstatus:
-            lat = f.createVariable('lat', 'f4', dimensions=('yc', 'xc'), fill_value=0x7FC00000)
+            lat = create_packed(f, 'lat', ('yc', 'xc'), pack, MISSING_FLOAT, chunksizes=chunks, **storage)
             lat.long_name = 'lat'
             lat.units = 'degrees_north'
 
-            lon = f.createVariable('lon', 'f4', dimensions=('yc', 'xc'), fill_value=0x7FC00000)
+            lon = create_packed(f, 'lon', ('yc', 'xc'), pack, MISSING_FLOAT, chunksizes=chunks, **storage)
             lon.long_name = 'lon'
             lon.units = 'degrees_east'
 
             f.Conventions = 'CF-1.10' # newest version of cf compliance
         else:
-            lat = f.createVariable('lat', 'f4', dimensions=('lines', 'elems'), fill_value=0x7FC00000)
+            lat = create_packed(f, 'lat', ('lines', 'elems'), pack, MISSING_FLOAT, chunksizes=chunks, **storage)
             lat.long_name = 'latitude'
             lat.units = 'degrees'
 
-            lon = f.createVariable('lon', 'f4', dimensions=('lines', 'elems'), fill_value=0x7FC00000)
+            lon = create_packed(f, 'lon', ('lines', 'elems'), pack, MISSING_FLOAT, chunksizes=chunks, **storage)
             lon.long_name = 'longitude'
             lon.units = 'degrees'
 
@@ -261,70 +343,266 @@ def write(area_file, latdata, londata, filename='NCDFxxxx.nc', audit_str=''):
         createdate[:] = adir.file_yyyddd
         createtime[:] = adir.file_hhmmss
         
-        if CFstatus:
-            data[:] = area_file.data
-        else:
-            data[:] = area_file.data
-
-        lat[:] = latdata
-        lon[:] = londata
-
-        audit_chunks = [audit_str[i:i+80] for i in range(0, num_chunks * 80, 80)]
-        if adir.comment_cards :
-            audit_chunks = adir.comment_cards + audit_chunks
-        audittrail[:] = nc.stringtochar(np.array([audit_chunks], 'S80'))
-
-
-def nav_transform(area):
-    '''Use AreaFile navigation and directory to transform lines/elems to lat/lon'''
-    from nvxgoes import nvxgoes as nvx
+        # one band at a time, all bands share the lat/lon grid below
+        for b in range(adir.spectral_band_count if not CFstatus else 1):
+            band_data = area_file.data[b]
+            for start in range(0, adir.lines, block_lines):
+                data[b, start:start + block_lines] = band_data[start:start + block_lines]
+
+        for var, source in ((lat, latdata), (lon, londata)):
+            write_grid(var, source, adir.lines, block_lines, pack)
+
+        audittrail[:] = audit_cards(adir, audit_str)
+
+
+# scalar variables that must match for an image to be appended to a time cube: (name, directory field, long_name)
+CUBE_GEOMETRY = (
+    ('version', 'image_type', 'McIDAS area file version'),
+    ('sensorID', 'sensor_source_number', 'McIDAS sensor number'),
+    ('startLine', 'line_ul', 'starting image line (in satellite coordinates)'),
+    ('startElem', 'element_ul', 'starting image element (in satellite coordintes)'),
+    ('dataWidth', 'bytes_per_element', 'number of 8-bit bytes per source data point'),
+    ('lineRes', 'line_res', 'resolution of each pixel in line direction'),
+    ('elemRes', 'element_res', 'resolution of each pixel in element direction'),
+    ('prefixSize', 'line_prefix_length', 'line prefix size in 8-bit bytes'),
+)
 
-    navsrt = datetime.datetime.now()
-    nav = area.nav
+# time-indexed variables of a time cube: (name, long_name)
+CUBE_TIMES = (
+    ('imageDate', 'image year and day of year (in ccyyddd format)'),
+    ('imageTime', 'image time in UTC (hours/minutes/seconds, in HHMMSS format)'),
+    ('crDate', 'image creation year and day of year in ccyyddd format'),
+    ('crTime', 'image creation time in UTC in hhmmss format'),
+)
 
-    # initialize nvxgoes module
-    nvx.nvxini(1, nav)
 
-    lat = []
-    lon = []
+def _create_cube(f, adir, nav_key, pack, chunks, storage):
+    '''Dimensions, variables and attributes of a CF time cube with an unlimited time dimension'''
+    f.createDimension('xc', adir.elements)
+    f.createDimension('yc', adir.lines)
+    f.createDimension('time', None)
+    f.createDimension('auditCount', None)
+    f.createDimension('auditSize', 80) # length of single comment card
+
+    for name, field, long_name in CUBE_GEOMETRY:
+        var = f.createVariable(name, 'i4')
+        var.long_name = long_name
+        var[:] = getattr(adir, field)
+    f['lineRes'].units = f['elemRes'].units = 'km'
+    band = f.createVariable('bands', 'i4')
+    band.long_name = 'satellite channel number'
+    band[:] = adir.bands[0]
+
+    time = f.createVariable('time', 'i4', dimensions=('time',))
+    time.long_name = 'seconds since 1970-1-1 0:0:0'
+    time.units = 'seconds since 1970-1-1 0:0:0'
+    for name, long_name in CUBE_TIMES:
+        f.createVariable(name, 'i4', dimensions=('time',)).long_name = long_name
+    audittrail = f.createVariable('auditTrail', 'S1', dimensions=('time', 'auditCount', 'auditSize'))
+    audittrail.long_name = 'audit trail'
+
+    data = create_packed(f, 'data', ('time', 'yc', 'xc'), pack, None,
+                         chunksizes=(1,) + tuple(chunks) if chunks else None, **storage)
+    data_attributes(data, adir)
+    data.coordinates = 'lon lat'
+
+    lat = create_packed(f, 'lat', ('yc', 'xc'), pack, MISSING_FLOAT, chunksizes=chunks, **storage)
+    lat.long_name = 'lat'
+    lat.units = 'degrees_north'
+    lon = create_packed(f, 'lon', ('yc', 'xc'), pack, MISSING_FLOAT, chunksizes=chunks, **storage)
+    lon.long_name = 'lon'
+    lon.units = 'degrees_east'
+
+    f.Conventions = 'CF-1.10'
+    f.Source = 'McIDAS Area File'
+    f.SatelliteSensor = adir.sensors[adir.sensor_source_number]
+    f.navKey = nav_key
+    return lat, lon
+
+
+def _check_cube(f, adir, nav_key, filename):
+    '''Raise ValueError unless adir has the geometry, band and nav of the time cube f'''
+    expected = {'lines': (len(f.dimensions['yc']), adir.lines),
+                'elements': (len(f.dimensions['xc']), adir.elements),
+                'bands': (int(f['bands'][...]), adir.bands[0])}
+    for name, field, _ in CUBE_GEOMETRY:
+        expected[name] = (int(f[name][...]), getattr(adir, field))
+    mismatched = [f'{k} {cube} != {image}' for k, (cube, image) in expected.items() if cube != image]
+    if getattr(f, 'navKey', None) != nav_key:
+        mismatched.append('nav block differs')
+    if mismatched:
+        raise ValueError(f'Image does not match the time cube {filename}: {", ".join(mismatched)}')
+
+
+def append(area_file, latdata, londata, filename='NCDFxxxx.nc', audit_str='', block_lines=512,
+           zlib=False, complevel=4, shuffle=False, chunks=None, pack=None):
+    '''
+    Append a single band image to a CF time cube, creating the file if needed
+
+    Images appended to one file must have the same geometry, band and nav
+    block (nav_cache_key, kept in the navKey attribute), they share the
+    lat/lon grid written with the first image, so latdata/londata are only
+    read when the file is created and may be None after that.
+    imageDate, imageTime, crDate, crTime and auditTrail are indexed by the
+    unlimited time dimension, in the order images are appended. An image
+    whose time is already in the cube is not written again. Returns the time
+    index of the image. The remaining arguments are as for write.
+    '''
+    if pack is True:
+        pack = LATLON_PACKING
+    storage = {'zlib': zlib, 'complevel': complevel, 'shuffle': shuffle}
 
-    curr_line = area.directory.line_ul
-    srt_elem = area.directory.element_ul
-    num_lines = area.directory.lines
-    num_elems = area.directory.elements
-    line_res = area.directory.line_res
-    elem_res = area.directory.element_res
-    for i in range(num_lines):
-        curr_elem = srt_elem
-        lat_row = []
-        lon_row = []
-        for j in range(num_elems):
-            nvxsae, xpar, ypar, zpar = nvx.nvxsae(curr_line, curr_elem, 0.0)
-            if nvxsae == -1:
-                lat_row.append(0x7FC00000) # value for missing data ( off the earth )
-                lon_row.append(0x7FC00000)
+    adir = area_file.directory
+    if adir.spectral_band_count > 1:
+        raise ValueError('Only single band images can be appended to a time cube')
+    nav_key = nav_cache_key(area_file)
+    seconds = (adir.nominal_time - datetime.datetime(1970, 1, 1)).total_seconds()
+
+    with netcdf_lock:
+        exists = os.path.exists(filename)
+        with metrics.stage('append', pixels=adir.lines * adir.elements), \
+                nc.Dataset(filename, 'a' if exists else 'w', format='NETCDF4') as f:
+            if exists:
+                _check_cube(f, adir, nav_key, filename)
+                times = f['time'][:]
+                if np.any(times == seconds):
+                    return int(np.flatnonzero(times == seconds)[0])
             else:
-                lat_row.append(xpar)
-                lon_row.append(-ypar)
-            curr_elem += elem_res
-        lat.append(lat_row)
-        lon.append(lon_row)
-        curr_line += line_res
+                if latdata is None or londata is None:
+                    raise ValueError(f'latdata and londata are needed to create the time cube {filename}')
+                lat, lon = _create_cube(f, adir, nav_key, pack, chunks, storage)
+                for var, source in ((lat, latdata), (lon, londata)):
+                    write_grid(var, source, adir.lines, block_lines, pack)
+
+            t = len(f.dimensions['time'])
+            yyyddd = adir.yyyddd
+            year = ((yyyddd // 1000) % 1900) + 1900
+            f['time'][t] = seconds
+            f['imageDate'][t] = int(f'{year}{yyyddd % 1000:03}')
+            f['imageTime'][t] = adir.hhmmss
+            f['crDate'][t] = adir.file_yyyddd
+            f['crTime'][t] = adir.file_hhmmss
+            cards = audit_cards(adir, audit_str)
+            f['auditTrail'][t, :len(cards)] = cards
+
+            data = f['data']
+            band_data = area_file.data[0]
+            for start in range(0, adir.lines, block_lines):
+                data[t, start:start + block_lines] = band_data[start:start + block_lines]
+    return t
+
+
+def nav_arrays(area, workers=None, step=None):
+    '''
+    Navigate the whole AreaFile at once, returns float32 lat/lon arrays with NaN off the earth
+
+    workers > 1 splits the lines into blocks navigated by that many processes.
+    step navigates a tie point grid every step lines and elements instead and
+    interpolates in between, see GoesNav.latlon_tiepoints
+    '''
+    nav = GoesNav(area.nav)
+    lines, elems = area_grid(area.directory)
+    if step:
+        lat, lon = nav.latlon_tiepoints(lines, elems, step)
+    elif workers and workers > 1:
+        lat, lon = nav_parallel(area.nav, lines, elems, workers)
+    else:
+        lat, lon = nav.latlon(lines, elems)
+
+    # calculate projection latitude and longitude from the satellite position
+    proj_lat, proj_lon = nav.subpoint(area.nav[2])
+    return lat, lon, proj_lat, proj_lon
 
 
-    # calculate satellite height and projection_longitude
-    x, y, z = nvx.satpos(0, nav[2])
-    height = np.sqrt(x**2 + y**2 + z**2) * 1000 # height in meters
-    proj_lat, proj_lon = nvx.nxyzll(x, y, z)
-    proj_lon = -proj_lon
+_nav_worker = {}
+
+
+def _init_nav_worker(nav, shm_names, shape):
+    '''Initialize the navigation once per worker and attach to the shared lat/lon arrays'''
+    metrics.start_worker()
+    _nav_worker['nav'] = GoesNav(nav)
+    _nav_worker['shm'] = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    _nav_worker['lat'], _nav_worker['lon'] = (np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+                                              for shm in _nav_worker['shm'])
+
+
+def _nav_block(start, lines, elems):
+    '''Navigate one block of lines into the shared arrays, returns the metrics records of the worker'''
+    with metrics.stage('nav_parallel.block', pixels=lines.shape[0] * elems.shape[1]):
+        lat, lon = _nav_worker['nav'].latlon(lines, elems)
+        _nav_worker['lat'][start:start + len(lines)] = lat
+        _nav_worker['lon'][start:start + len(lines)] = lon
+    return metrics.drain()
+
+
+def pool_context():
+    '''
+    Default multiprocessing context in a single threaded process, forkserver
+    once other threads run, as forking then can copy locks those threads hold
+    '''
+    return None if threading.active_count() == 1 else multiprocessing.get_context('forkserver')
+
+
+def nav_parallel(nav, lines, elems, workers, blocks_per_worker=4):
+    '''Navigate blocks of lines in worker processes that write straight into shared memory'''
+    shape = (lines.shape[0], elems.shape[1])
+    nbytes = max(int(np.prod(shape)) * 4, 1)
+    shms = [shared_memory.SharedMemory(create=True, size=nbytes) for _ in range(2)]
+    try:
+        block = max(1, -(-shape[0] // (workers * blocks_per_worker)))
+        starts = list(range(0, shape[0], block))
+        initargs = (list(nav), [shm.name for shm in shms], shape)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_nav_worker, initargs=initargs,
+                                 mp_context=pool_context()) as pool:
+            for records in pool.map(_nav_block, starts, [lines[s:s + block] for s in starts], [elems] * len(starts)):
+                metrics.merge(records)
+        lat, lon = (np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy() for shm in shms)
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return lat, lon
+
+
+def nav_cache_key(area, step=None):
+    '''Cache key for the navigation of an AreaFile: nav block plus image geometry'''
+    adir = area.directory
+    geometry = (adir.line_ul, adir.element_ul, adir.lines, adir.elements, adir.line_res, adir.element_res)
+    if step:
+        return cache_key('nav_transform', 'float32 nan', list(area.nav), geometry, 'tiepoints', step)
+    return cache_key('nav_transform', 'float32 nan', list(area.nav), geometry)
+
+
+def nav_transform(area, cache=None, workers=None, step=None):
+    '''
+    Use AreaFile navigation and directory to transform lines/elems to lat/lon
+
+    lat/lon are float32 arrays with NaN (MISSING_FLOAT) off the earth.
+    cache is an optional filecache.FileCache, on a hit the lat/lon arrays are
+    returned memory-mapped from disk instead of being navigated again.
+    workers > 1 navigates in that many processes, step interpolates between
+    tie points every step pixels, see nav_arrays
+    '''
+    adir = area.directory
+    with metrics.stage('nav_transform', pixels=adir.lines * adir.elements, cache_hit=False, step=step) as m:
+        if cache is not None:
+            key = nav_cache_key(area, step)
+            hit = cache.load(key)
+            if hit is not None:
+                arrays, meta = hit
+                m['cache_hit'] = True
+                return arrays['lat'], arrays['lon'], meta['proj_lat'], meta['proj_lon']
+
+        lat, lon, proj_lat, proj_lon = nav_arrays(area, workers=workers, step=step)
+
+        if cache is not None:
+            cache.save(key, {'lat': lat, 'lon': lon}, {'proj_lat': proj_lat, 'proj_lon': proj_lon})
 
-    navstop = datetime.datetime.now()
-    print(navstop - navsrt)
     return lat, lon, proj_lat, proj_lon
 
 def nav_transform2(area):
+    '''Reference navigation through nvxgoes.nvxsae, one pixel at a time'''
     from nvxgoes import nvxgoes as nvx
-    navsrt = datetime.datetime.now()
     nav = area.nav
 
     nvx.nvxini(1, nav)
@@ -338,30 +616,28 @@ def nav_transform2(area):
     lines = [curr_line + i * line_res for i in range(num_lines)]
     elems = [curr_elem + i * elem_res for i in range(num_elems)]
     
-    lat = [ [-1] * num_elems for i in range(num_lines) ]
-    lon = [ [-1] * num_elems for i in range(num_lines) ]
+    lat = np.full((num_lines, num_elems), MISSING_FLOAT, dtype=np.float32)
+    lon = np.full((num_lines, num_elems), MISSING_FLOAT, dtype=np.float32)
     
-    for i in range(num_lines):
-        for j in range(num_elems):
-            nvxsae, xpar, ypar, zpar = nvx.nvxsae(lines[i], elems[j], 0.0)
-            if nvxsae != -1:
-                lat[i][j] = xpar
-                lon[i][j] = ypar
+    with metrics.stage('nav_transform2', pixels=num_lines * num_elems):
+        for i in range(num_lines):
+            for j in range(num_elems):
+                nvxsae, xpar, ypar, zpar = nvx.nvxsae(lines[i], elems[j], 0.0)
+                if nvxsae != -1:
+                    lat[i, j] = xpar
+                    lon[i, j] = -ypar
     
     x, y, z = nvx.satpos(0, nav[2])
     height = np.sqrt(x**2 + y**2 + z**2) * 1000 # height in meters
     proj_lat, proj_lon = nvx.nxyzll(x, y, z)
     proj_lon = -proj_lon
-    print(datetime.datetime.now() - navsrt)
 
     return lat, lon, proj_lat, proj_lon
 
 if __name__ == '__main__':
-    from pyarea.file import AreaFile
-    with open('../AREA9996', 'rb') as f:
-        c = f.read()   
+    from mmaparea import open_area
 #    audit = './fetchfile.py host=geoarc.ssec.wisc.edu user=DAS project=6999 group=AGOES02 descriptor=A-VIS file=AREA9998  unit=BRIT nlines=700 nelems=700 lmag=-22 emag=-22 stime=17.5 etime=17.5 position=0 band=1 day=1978055'
-    a = AreaFile(c)
+    a = open_area('../AREA9996')
     lat, lon, _, _ = nav_transform2(a)
     print(lat[355][345])
     print(lon[355][345])